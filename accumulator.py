@@ -0,0 +1,107 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Totals and extremes of the current day. The rain rate is integrated
+#   over the real times of the observations, not over the interval of the
+#   plugin, and the day rolls over exactly at local midnight. Every new
+#   observation only updates the running values.
+#
+
+from datetime import datetime, time, timedelta
+
+# Rain is not added over a gap between two observations longer than this,
+# nobody knows what happened in the meantime
+MAX_GAP     = timedelta(hours=1)
+
+class DailyAccumulator:
+
+    def __init__(self, maxGap=MAX_GAP):
+        self._maxGap        = maxGap
+        self._last          = None      # Time of the last observation
+        self._lastRate      = None      # Rain rate of the last observation, mm/hour
+        self.day            = None      # The day of the values
+        self.rain           = 0.0       # mm
+        self.minTemperature = None      # degrees Celsius
+        self.maxTemperature = None      # degrees Celsius
+        self.maxGusts       = None      # m/s
+
+    #
+    # Add an observation, the values may be None.
+    # Returns False when it is not newer than the last observation.
+    #
+
+    def add(self, when, rainRate, temperature, windSpeedGusts):
+
+        if self._last != None and when <= self._last:
+            return False
+
+        if self.day == None:
+            self.rollover(when.date())
+
+        # The rain between the last and this observation, the average
+        # of both rates times the time in between. Around midnight the
+        # part before midnight still counts for the day before.
+        if self._lastRate != None and rainRate != None and when - self._last <= self._maxGap:
+            midnight = datetime.combine(when.date(), time())
+            if self._last < midnight:
+                rateAtMidnight = self._lastRate + (rainRate - self._lastRate) * ((midnight - self._last) / (when - self._last))
+                self.rain += self.integrate(self._last, self._lastRate, midnight, rateAtMidnight)
+                self.rollover(when.date())
+                self.rain += self.integrate(midnight, rateAtMidnight, when, rainRate)
+            else:
+                self.rain += self.integrate(self._last, self._lastRate, when, rainRate)
+
+        if when.date() != self.day:
+            self.rollover(when.date())
+
+        self._last = when
+        self._lastRate = rainRate
+
+        if temperature != None:
+            if self.minTemperature == None or temperature < self.minTemperature:
+                self.minTemperature = temperature
+            if self.maxTemperature == None or temperature > self.maxTemperature:
+                self.maxTemperature = temperature
+        if windSpeedGusts != None:
+            if self.maxGusts == None or windSpeedGusts > self.maxGusts:
+                self.maxGusts = windSpeedGusts
+
+        return True
+
+    #
+    # Start a new day
+    #
+
+    def rollover(self, day):
+
+        self.day = day
+        self.rain = 0.0
+        self.minTemperature = None
+        self.maxTemperature = None
+        self.maxGusts = None
+
+    #
+    # The rain of today in mm, 0 when there is no observation of today yet
+    #
+
+    def rainToday(self, now=None):
+
+        if now == None:
+            now = datetime.now()
+        if self.day != now.date():
+            return 0.0
+        return self.rain
+
+    #
+    # mm of rain between two times with a linear changing rate
+    #
+
+    def integrate(self, start, startRate, end, endRate):
+
+        return (startRate + endRate) / 2 * (end - start).total_seconds() / 3600
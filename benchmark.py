@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Benchmarks for the hot paths of the plugin
+#   They run against synthetic feeds, so no network is needed
+#
+#   ./benchmark.py              run and compare with the saved baseline
+#   ./benchmark.py --save       run and save the results as the baseline
+#
+
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+import fakeDomoticz
+import logger
+from buienradar import Buienradar, STATIONS_PATH, STATION_FIELDS, clearFeedCache
+from spatialindex import SpatialIndex
+from rainforecast import RainForecast, RainSeries
+
+# The number of weather stations: the real feed, a big one and a stress test
+STATION_COUNTS  = (50, 1000, 10000)
+
+# The number of 5 minute slots of the rain forecast: 2 and 4 hours
+RAIN_SLOTS      = (24, 48)
+
+# Where the results are saved with --save
+BASELINE_FILE   = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark.json')
+
+# Home location of the benchmarks, De Bilt
+HOME_LAT        = 52.101547
+HOME_LON        = 5.177919
+
+#
+# Generate a feed that looks like http://xml.buienradar.nl
+# with the given number of weather stations
+#
+
+def generateFeed(stations, seed=1):
+
+    rnd = random.Random(seed)
+    out = [ '<?xml version="1.0" encoding="utf-8"?>',
+            '<buienradarnl><weergegevens><actueel_weer><weerstations>' ]
+
+    for i in range(stations):
+        # The first station is De Bilt, the backup station
+        sid = 6260 if i == 0 else 10000 + i
+        lat = 50.75 + rnd.random() * 2.8
+        lon = 3.35 + rnd.random() * 3.85
+
+        # Many stations only measure the wind
+        def value(v):
+            return v if rnd.random() > 0.3 else '-'
+
+        out.append('<weerstation id="{0}"><stationcode>{0}</stationcode>'
+                   '<stationnaam regio="Regio {1}">Meetstation {1}</stationnaam>'
+                   '<lat>{2:.2f}</lat><lon>{3:.2f}</lon><datum>10/18/2026 14:00:00</datum>'
+                   '<luchtvochtigheid>{4}</luchtvochtigheid><temperatuurGC>{5}</temperatuurGC>'
+                   '<windsnelheidMS>{6:.1f}</windsnelheidMS><windsnelheidBF>3</windsnelheidBF>'
+                   '<windrichtingGR>{7}</windrichtingGR><windrichting>ZW</windrichting>'
+                   '<luchtdruk>{8}</luchtdruk><zichtmeters>{9}</zichtmeters>'
+                   '<windstotenMS>{10:.1f}</windstotenMS><regenMMPU>{11}</regenMMPU>'
+                   '<zonintensiteitWM2>{12}</zonintensiteitWM2>'
+                   '<icoonactueel ID="c" zin="Zwaar bewolkt">https://www.buienradar.nl/icon.png</icoonactueel>'
+                   '<temperatuur10cm>9.8</temperatuur10cm><url>https://www.buienradar.nl/</url>'
+                   '<latGraden>{2:.2f}</latGraden><lonGraden>{3:.2f}</lonGraden></weerstation>'.format(
+                       sid, i, lat, lon,
+                       value(rnd.randint(40, 100)), value('{:.1f}'.format(rnd.uniform(-5, 25))),
+                       rnd.uniform(0, 15), value(rnd.randint(0, 360)),
+                       '1012.3' if i == 0 else value('{:.1f}'.format(rnd.uniform(980, 1040))),
+                       '25000' if i == 0 else value(rnd.randint(100, 50000)),
+                       rnd.uniform(0, 25), value('{:.1f}'.format(rnd.uniform(0, 5))),
+                       value(rnd.randint(0, 800))))
+
+    out.append('</weerstations></actueel_weer>'
+               '<verwachting_vandaag><titel>Wisselvallig met af en toe regen</titel>'
+               '<tijdweerbericht>10/18/2026 12:00:00</tijdweerbericht>'
+               '<samenvatting>Bewolkt</samenvatting><tekst>Bewolkt met regen</tekst></verwachting_vandaag>'
+               '</weergegevens></buienradarnl>')
+    return '\n'.join(out).encode('utf-8')
+
+#
+# Generate a rain forecast that looks like the one of Buienradar,
+# with the given number of 5 minute slots
+#
+
+def generateRainText(slots=24, seed=1, start=datetime(2026, 10, 18, 18, 30)):
+
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(slots):
+        val = 0 if rnd.random() < 0.5 else rnd.randint(1, 180)
+        lines.append('{:03d}|{}'.format(val, (start + timedelta(minutes=5 * i)).strftime('%H:%M')))
+    return '\r\n'.join(lines) + '\r\n'
+
+#
+# Seconds one call takes, the best of a few runs
+#
+
+def measure(func, number):
+
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+#
+# Bytes of memory allocated at the peak of one call
+#
+
+def peakMemory(func):
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+#
+# The loop of RainForecast.parse_precipfc_data() before RainSeries was added
+#
+
+def originalRainLoop(text, timeframe):
+
+    maxrain = totalrainmm = numberoflines = 0
+    lines = text.splitlines()
+    index = 0
+    nrlines = min(len(lines), round(float(timeframe)/5) + 1)
+    while index < nrlines:
+        (val, key) = lines[index].split("|")
+        if int(val) == 0:
+            mmu = 0
+        else:
+            mmu = 10**(float((int(val) - 109))/32)
+        if maxrain < mmu:
+            maxrain = mmu
+        totalrainmm += float(mmu)
+        numberoflines += 1
+        index += 1
+        fakeDomoticz.Debug(str(val) + '|' + str(key))
+    return maxrain, totalrainmm, numberoflines
+
+#
+# Compare the original loop with parsing the whole series once into a RainSeries.
+# The series is parsed once per download, the windows are taken on every poll.
+#
+
+def benchRainParse(results, slots, timeframes=(15, 30, 60, 120), number=2000):
+
+    text = generateRainText(slots)
+    now = datetime(2026, 10, 18, 18, 31)
+    rain = RainSeries.parse(text, now)
+
+    def loop():
+        for timeframe in timeframes:
+            originalRainLoop(text, timeframe)
+
+    def parse():
+        RainSeries.parse(text, now)
+
+    def windows():
+        first = rain.index_at(now)
+        maxima = rain.running_max(first, first + round(float(max(timeframes))/5) + 1)
+        for timeframe in timeframes:
+            rows = min(len(maxima), round(float(timeframe)/5) + 1)
+            maxima[rows - 1]
+            rain.total(first, first + rows)
+
+    t_loop = measure(loop, number)
+    t_parse = measure(parse, number)
+    t_windows = measure(windows, number)
+
+    print('{:>6} slots, {} timeframes: loop {:8.1f} us | RainSeries parse {:8.1f} us + windows {:8.1f} us'.format(
+        slots, len(timeframes), t_loop * 1e6, t_parse * 1e6, t_windows * 1e6))
+
+    results['RainSeries.parse, ' + str(slots) + ' slots'] = t_parse
+    results['RainSeries windows, ' + str(slots) + ' slots'] = t_windows
+
+#
+# Compare the work of one fetch: the scans of the tree like the plugin did
+# before the station index, with building the index and its lookups. Both
+# find the nearby station, read its values and the ones of De Bilt. The
+# scans are done for every location, the index is built once per fetch.
+#
+
+def benchStationLookup(results, stations, locations=10, number=20):
+
+    feed = generateFeed(stations)
+    tree = ET.ElementTree(file=io.BytesIO(feed))
+    br = Buienradar(HOME_LAT, HOME_LON)
+    backupID = '6260'
+
+    def readStation(station):
+        return [ br.parseFloatValue(station.find(field).text) for field in STATION_FIELDS[5:] ]
+
+    def xpath():
+        # The nearby station, a scan with the float parsing of every station
+        distance = 10000.0
+        stationID = ""
+        for station in tree.iterfind(STATIONS_PATH):
+            if br.parseFloatValue(station.find('temperatuurGC').text) == None:
+                continue
+            dist = br.haversine(HOME_LAT, HOME_LON, float(station.find('lat').text), float(station.find('lon').text))
+            if dist < distance:
+                distance = dist
+                stationID = station.get('id')
+
+        # The "Found ... km" log message, the values and De Bilt for the pressure and the visibility
+        for path in (stationID, stationID, backupID, backupID):
+            for station in tree.iterfind(STATIONS_PATH + '[@id=\'' + path + '\']'):
+                readStation(station)
+
+    def build():
+        records = [ br.elementToRecord(station, STATION_FIELDS) for station in tree.iterfind(STATIONS_PATH) ]
+        br.setFeed(br.buildFeed(records, None))
+
+    def index():
+        nearby = br.nearest(HOME_LAT, HOME_LON, 1, ('temperature',))
+        station = br.stationIndex.get(nearby[0][1].id)
+        backup = br.stationIndex.get(backupID)
+        return station.pressure, station.visibility, backup.pressure, backup.visibility
+
+    build()
+    t_xpath = measure(xpath, number)
+    t_build = measure(build, number)
+    t_index = measure(index, number)
+
+    # From this number of locations the index is faster
+    breakEven = t_build / (t_xpath - t_index) if t_xpath > t_index else float('inf')
+
+    print('{:>6} stations, per fetch: 1 location xpath {:8.3f} ms, index {:8.3f} ms | {} locations xpath {:8.3f} ms, index {:8.3f} ms | index faster from {:.1f} locations'.format(
+        stations, t_xpath * 1000, (t_build + t_index) * 1000,
+        locations, t_xpath * locations * 1000, (t_build + t_index * locations) * 1000, breakEven))
+
+    results['station xpath scans, ' + str(stations) + ' stations'] = t_xpath
+    results['station index build, ' + str(stations) + ' stations'] = t_build
+    results['station index lookups, ' + str(stations) + ' stations'] = t_index
+
+#
+# Compare the linear haversine scan with the spatial index
+# when many home locations are resolved against the same feed
+#
+
+def benchNearest(results, stations, locations=200, number=3):
+
+    br = Buienradar()
+    br.setFeed(br.parseFeed(io.BytesIO(generateFeed(stations))))
+    candidates = list(br.stationIndex.values())
+
+    rnd = random.Random(2)
+    homes = [ (50.75 + rnd.random() * 2.8, 3.35 + rnd.random() * 3.85) for _ in range(locations) ]
+
+    def linear():
+        for lat, lon in homes:
+            distance = 10000.0
+            for station in candidates:
+                if station.temperature == None:
+                    continue
+                dist = br.haversine(lat, lon, station.lat, station.lon)
+                if dist < distance:
+                    distance = dist
+
+    def build():
+        return SpatialIndex(candidates)
+
+    index = build()
+
+    def kdtree():
+        for lat, lon in homes:
+            index.nearest(lat, lon, 1, ('temperature',))
+
+    t_linear = measure(linear, number)
+    t_build = measure(build, number)
+    t_kdtree = measure(kdtree, number)
+
+    print('{:>6} stations, {} locations: linear {:8.3f} ms | kd-tree build {:8.3f} ms + queries {:8.3f} ms'.format(
+        stations, locations, t_linear * 1000, t_build * 1000, t_kdtree * 1000))
+
+    results['kd-tree build, ' + str(stations) + ' stations'] = t_build
+    results['kd-tree queries, ' + str(stations) + ' stations'] = t_kdtree
+
+#
+# Time the calls the plugin makes for every update, like plugin.py does them
+#
+
+def benchPlugin(results, stations, number=5):
+
+    folder = tempfile.mkdtemp()
+    xmlFile = os.path.join(folder, 'buienradar.xml')
+    with open(xmlFile, 'wb') as f:
+        f.write(generateFeed(stations))
+
+    br = Buienradar(HOME_LAT, HOME_LON, streaming=True)
+
+    def xml():
+        br.getBuienradarXML(file=xmlFile)
+
+    def nearby():
+        br.getNearbyWeatherStation()
+
+    def weather():
+        br.getWeather()
+
+    xml()
+    nearby()
+    for name, func, repeat in (('getBuienradarXML', xml, number), ('getNearbyWeatherStation', nearby, number * 1000), ('getWeather', weather, number * 1000)):
+        seconds = measure(func, repeat)
+        peak = peakMemory(func)
+        results[name + ', ' + str(stations) + ' stations'] = seconds
+        print('{:>6} stations: {:<24} {:10.3f} ms, peak memory {:8.1f} kB'.format(stations, name, seconds * 1000, peak / 1024))
+
+    os.remove(xmlFile)
+    os.rmdir(folder)
+
+def benchRainForecast(results, slots, number=500):
+
+    folder = tempfile.mkdtemp()
+    rainFile = os.path.join(folder, 'raintext.txt')
+    with open(rainFile, 'w') as f:
+        f.write(generateRainText(slots))
+
+    rf = RainForecast(HOME_LAT, HOME_LON, 30, horizons=(60, 120))
+    rf.get_rain(file=rainFile)
+    now = datetime(2026, 10, 18, 18, 31)
+
+    # The first parse after a download also parses the series
+    def parse():
+        rf.series = None
+        rf.parse_precipfc_data(now)
+
+    seconds = measure(parse, number)
+    peak = peakMemory(parse)
+    results['parse_precipfc_data, ' + str(slots) + ' slots'] = seconds
+    print('{:>6} slots:    {:<24} {:10.3f} ms, peak memory {:8.1f} kB'.format(slots, 'parse_precipfc_data', seconds * 1000, peak / 1024))
+
+    os.remove(rainFile)
+    os.rmdir(folder)
+
+#
+# Compare the results with the baseline, slower is a positive percentage
+#
+
+def compare(results, baseline):
+
+    print()
+    print('Compared with the baseline:')
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before == None or before == 0:
+            continue
+        change = (seconds - before) / before * 100
+        print('  {:<48} {:10.3f} ms -> {:10.3f} ms {:+7.1f}%{}'.format(
+            name, before * 1000, seconds * 1000, change, '  SLOWER' if change > 20 else ''))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the Buienradar plugin')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='the file with the baseline')
+    args = parser.parse_args()
+
+    # Do not let the log messages influence the timings
+    fakeDomoticz.Log = fakeDomoticz.Debug = lambda s: None
+    logger.setLevel(logger.ERROR)
+
+    results = {}
+    for stations in STATION_COUNTS:
+        clearFeedCache()
+        benchPlugin(results, stations)
+    for slots in RAIN_SLOTS:
+        benchRainForecast(results, slots)
+    print()
+    for stations in STATION_COUNTS:
+        benchStationLookup(results, stations)
+    for stations in STATION_COUNTS:
+        benchNearest(results, stations)
+    for slots in RAIN_SLOTS:
+        benchRainParse(results, slots)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print()
+        print('Baseline saved to ' + args.baseline)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
@@ -12,186 +12,103 @@
 #   - Check if Barometer and Visibility are present in weather station, else get data from De Bilt weather station
 #   - Some changes in handling the lat, lon and interval
 
-try:
-    import Domoticz
-except ImportError:
-    import fakeDomoticz as Domoticz
-
-import urllib.request
-import urllib.error
+import io
+import threading
+import time
 import xml.etree.ElementTree as ET
+from collections import namedtuple
 from math import radians, cos, sin, asin, sqrt
-from datetime import datetime, timedelta
-
-class Buienradar:
-
-    def __init__(self, latitude=52.101547, longitude=5.177919, interval=10):
-        self._lat               = latitude
-        self._lon               = longitude
-        self._interval          = interval
-        self.lastUpdate         = datetime.now()
-        self.stationID          = ""
-        self.stationIDbackup    = "6260"       # Weather station De Bilt, used for missing information
-        self.tree               = None
-        self.resetWeatherValues()
-        self.rainToday          = 0
-
-    def resetWeatherValues(self):
-
-        self.observationDate    = datetime.now()
-        self.temperature        = None  # degrees Celsius
-        self.windSpeed          = None  # m/s
-        self.windBearing        = None  # degrees
-        self.windSpeedGusts     = None  # m/s
-        self.pressure           = None  # hPa
-        self.humidity           = None  # percentage
-        self.visibility         = None  # meters
-        self.solarIrradiance    = None  # W/m2
-        self.rainRate           = None  # mm/hour
-        self.weatherForecast    = None  # weather forecast prediction
-        self.weatherFCDateTime  = None  # weather forecast prediction date and time
-
-    #
-    # Calculate the great circle distance between two points
-    # on the earth (specified in decimal degrees)
-    #
-
-    def haversine(self, lat1, lon1, lat2, lon2):
-
-        # Convert decimal degrees to radians
-        lat1, lon1, lat2, lon2 = map(radians, [ lat1, lon1, lat2, lon2 ])
-
-        # Haversine formula
-        dlat = abs(lat2 - lat1)
-        dlon = abs(lon2 - lon1)
-        a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-        c = 2 * asin(sqrt(a))
-        km = c * 6367
-        return km
-
-    #
-    # Get the weather information from http://xml.buienradar.nl
-    #
-
-    def getBuienradarXML(self, file = ''):
-
-        self.tree = None
-
-        if file != '':
-            self.tree = ET.ElementTree(file=file)
-            return
+from datetime import datetime
+from spatialindex import SpatialIndex
+from diskcache import DiskCache
+from history import ObservationHistory
+from accumulator import DailyAccumulator
+from httpclient import client, HttpError
+import logger
+import stats
+
+# Where to get the feed
+FEED_URL        = 'http://xml.buienradar.nl/'
+FEED_URL_BACKUP = 'https://api.buienradar.nl/'
+
+# A cached feed is refreshed a heartbeat before the interval has passed
+FEED_TTL_MARGIN = 30
+
+# Returned when the feed has not been modified since the last download
+NOT_MODIFIED    = object()
+
+# Paths of the parts of the feed that are used
+STATIONS_PATH   = 'weergegevens/actueel_weer/weerstations/weerstation'
+FORECAST_PATH   = 'weergegevens/verwachting_vandaag'
+
+# The elements of a weather station and the forecast that are kept
+STATION_FIELDS  = ('stationcode', 'stationnaam', 'lat', 'lon', 'datum',
+                   'temperatuurGC', 'windsnelheidMS', 'windrichtingGR', 'windstotenMS',
+                   'luchtdruk', 'luchtvochtigheid', 'zichtmeters', 'zonintensiteitWM2', 'regenMMPU')
+FORECAST_FIELDS = ('titel', 'tijdweerbericht')
+
+# The fields of WeatherStation that come from the nearest station that
+# reports them when the station nearby does not, with their name in the log
+FALLBACK_FIELDS = { 'temperature': 'Temperature', 'pressure': 'Barometer', 'visibility': 'Visibility',
+                    'solarIrradiance': 'Solar Irradiance', 'rainRate': 'Rain rate' }
 
-        url         = 'http://xml.buienradar.nl/'
-        urlbackup   = 'https://api.buienradar.nl/'
-        try:
-            Domoticz.Log('Retrieve weather data from ' + url)
-            xml = urllib.request.urlopen(url, data=None)
-        except (urllib.error.HTTPError, urllib.error.URLError) as e:
-            Domoticz.Error("Error: " + str(e) + " URL: " + url)
-            Domoticz.Log("Going to try another Buienradar URL")
-            try:
-                Domoticz.Log('Retrieve weather data from ' + urlbackup)
-                xml = urllib.request.urlopen(urlbackup, data=None)
-            except (urllib.error.HTTPError, urllib.error.URLError) as e:
-                Domoticz.Error("Error: " + str(e) + " URL: " + urlbackup)
-
-        try:
-            self.tree = ET.parse(xml)
-        except ET.ParseError as err:
-            Domoticz.Log("XML parsing error: " + str(err))
-
-        self.lastUpdate = datetime.now()
-
-    #
-    # Find the weather station nearby
-    #
-
-    def getNearbyWeatherStation(self):
-
-        # Is the tree set?
-        if self.tree == None:
-            Domoticz.Log('No XML file found, try again later')
-            return
-
-        # Start distance far away
-        distance = 10000.0
-
-        # Go through all the weather stations
-        for stations in self.tree.iterfind('weergegevens/actueel_weer/weerstations'):
-
-            ### Check if XML contains weather stations
-            if stations.find('weerstation'):
-                Domoticz.Debug('XML file contains weather station information')
-            else:
-                Domoticz.Log('XML file contains no weather station information, try again later')
-                return
-        
-            for station in stations.findall('weerstation'):
-
-                # What is the temperature at this station?
-                temp = self.parseFloatValue(station.find('temperatuurGC').text)
-
-                # If no is temperature set, skip this entry
-                # Many weather stations only measure wind speed
-                # They are not useful for weather information in domoticz
-                if temp == None:
-                    continue
-
-                # Where is this station?
-                lat = float(station.find('lat').text)
-                lon = float(station.find('lon').text)
-
-                # Is this the station nearby?
-                dist = self.haversine(self._lat, self._lon, lat, lon)
-                if dist < distance:
-                    distance = dist
-                    self.stationID = station.get('id')
-
-        # This is the station nearby
-        for station in self.tree.iterfind('weergegevens/actueel_weer/weerstations/weerstation[@id=\''+ self.stationID +'\']'):
-            Domoticz.Log('Found ' + station.find('stationnaam').text + ' (ID: ' + station.find('stationcode').text + ') at ' + "{:.1f}".format(distance) + ' km from your home location')
-            break
-
-        # Check if location is outside of The Netherlands
-        if distance > 100:
-            Domoticz.Log("Your location (" + str(self._lat) + "," +  str(self._lon) + ") is too far away...")
-            Domoticz.Log("This plugin only works for locations within The Netherlands")
-            self.stationID = ""
-
-    #
-    # Check if interval has passed and update can be collected
-    #
-
-    def needUpdate(self):
-
-        # Is a weather station found?
-        if self.stationID == "":
-            return False
-
-        nextUpdate = self.lastUpdate + timedelta(minutes=self._interval)
-        return datetime.now() > nextUpdate
-
-    #
-    # Parse an int and return None if no int is given
-    #
-
-    def parseIntValue(self, s):
-
-        try:
-            return int(s)
-        except:
-            return None
+#
+# A weather station of the feed with all its values parsed
+#
 
-    #
-    # Parse a float and return None if no float is given
-    #
+class WeatherStation:
+
+    __slots__ = ('id', 'code', 'name', 'lat', 'lon', 'datum',
+                 'temperature', 'windSpeed', 'windBearing', 'windSpeedGusts', 'pressure',
+                 'humidity', 'visibility', 'solarIrradiance', 'rainRate')
+
+    def __init__(self, id, code, name, lat, lon, datum,
+                 temperature, windSpeed, windBearing, windSpeedGusts, pressure,
+                 humidity, visibility, solarIrradiance, rainRate):
+        self.id                 = id
+        self.code               = code
+        self.name               = name
+        self.lat                = lat               # degrees
+        self.lon                = lon               # degrees
+        self.datum              = datum             # date and time of the observation
+        self.temperature        = temperature       # degrees Celsius
+        self.windSpeed          = windSpeed         # m/s
+        self.windBearing        = windBearing       # degrees
+        self.windSpeedGusts     = windSpeedGusts    # m/s
+        self.pressure           = pressure          # hPa
+        self.humidity           = humidity          # percentage
+        self.visibility         = visibility        # meters
+        self.solarIrradiance    = solarIrradiance   # W/m2
+        self.rainRate           = rainRate          # mm/hour
 
-    def parseFloatValue(self, s):
+#
+# The weather at the location, built once per fetch and never changed
+#
 
-        try:
-            return float(s)
-        except:
-            return None
+class Observation(namedtuple('Observation', [
+        'stationID',
+        'observationDate',      # date and time of the observation
+        'temperature',          # degrees Celsius
+        'windSpeed',            # m/s
+        'windBearing',          # degrees
+        'windSpeedGusts',       # m/s
+        'pressure',             # hPa
+        'humidity',             # percentage
+        'visibility',           # meters
+        'solarIrradiance',      # W/m2
+        'rainRate',             # mm/hour
+        'rainToday',            # mm
+        'minTemperatureToday',  # degrees Celsius
+        'maxTemperatureToday',  # degrees Celsius
+        'maxGustsToday',        # m/s
+        'weatherForecast',      # weather forecast prediction
+        'weatherFCDateTime',    # weather forecast prediction date and time
+        'pressureTendency',     # hPa in 3 hours
+        'temperatureChange',    # degrees Celsius per hour
+        'sources',              # station ID by field of FALLBACK_FIELDS
+        ])):
+
+    __slots__ = ()
 
     #
     # Based on https://nl.wikipedia.org/wiki/Gevoelstemperatuur
@@ -284,6 +201,12 @@ class Buienradar:
         if self.pressure < 966:
             return 4
 
+        # A quickly falling pressure means the weather gets worse
+        if self.pressureTendency != None and self.pressureTendency <= -3:
+            if self.pressure < 1013:
+                return 6
+            return 3
+
         # Cloudy/Rain = 6
         if self.pressure < 993:
             return 6
@@ -332,81 +255,595 @@ class Buienradar:
         # Normal
         return 0
 
+# Observation without any values
+NO_OBSERVATION = Observation(*([ None ] * len(Observation._fields)))
+
+#
+# The parsed feed, the same for every location
+#
+
+class Feed:
+
+    __slots__ = ('stationIndex', 'spatialIndex', 'forecast', 'fetched')
+
+    def __init__(self, stationIndex, spatialIndex, forecast):
+        self.stationIndex       = stationIndex      # Weather stations by their ID
+        self.spatialIndex       = spatialIndex      # Weather stations by their location
+        self.forecast           = forecast          # Forecast record
+        self.fetched            = time.monotonic()
+
+#
+# Feeds shared by all the instances in this process, by URL
+#
+
+_feedLock       = threading.Lock()
+_feedCache      = {}        # URL -> Feed
+_feedFetching   = {}        # URL -> [ Event that is set when the fetch is done, its Feed ]
+
+#
+# Get the feed of the URL from the cache when it is younger than ttl seconds,
+# otherwise fetch() it. When another thread is already fetching it, wait for
+# that fetch instead of starting a second one.
+#
+
+def getSharedFeed(url, ttl, fetch):
+
+    with _feedLock:
+        feed = _feedCache.get(url)
+        if feed != None and time.monotonic() - feed.fetched < ttl:
+            return feed
+
+        inFlight = _feedFetching.get(url)
+        if inFlight == None:
+            inFlight = _feedFetching[url] = [ threading.Event(), None ]
+            fetching = True
+        else:
+            fetching = False
+
+    if not fetching:
+        inFlight[0].wait()
+        return inFlight[1]
+
+    try:
+        inFlight[1] = fetch()
+    finally:
+        with _feedLock:
+            if inFlight[1] != None:
+                _feedCache[url] = inFlight[1]
+            del _feedFetching[url]
+        inFlight[0].set()
+
+    return inFlight[1]
+
+#
+# Forget all the cached feeds
+#
+
+def clearFeedCache():
+
+    with _feedLock:
+        _feedCache.clear()
+
+class Buienradar:
+
+    def __init__(self, latitude=52.101547, longitude=5.177919, interval=10, streaming=False, cacheFolder=None):
+        self._lat               = latitude
+        self._lon               = longitude
+        self._interval          = interval
+        self._streaming         = streaming
+        self._cache             = None         # Copy of the feed on disk
+        if cacheFolder != None:
+            self._cache         = DiskCache(cacheFolder, 'buienradar')
+        self.stationID          = ""
+        self.fieldStations      = None         # Station ID by field of FALLBACK_FIELDS, for this feed
+        self._loggedSources     = {}           # The field stations that were logged
+        self.feed               = None         # The parsed feed, shared with other instances
+        self.forecast           = None         # Forecast record
+        self.stationIndex       = None         # Weather stations by their ID
+        self.spatialIndex       = None         # Weather stations by their location
+        self.daily              = DailyAccumulator()    # The totals of today
+        self.history            = ObservationHistory()  # The recent observations, to follow the trends
+        self.resetWeatherValues()
+
+    def resetWeatherValues(self):
+
+        self.observation        = NO_OBSERVATION
+
+    #
+    # Calculate the great circle distance between two points
+    # on the earth (specified in decimal degrees)
+    #
+
+    def haversine(self, lat1, lon1, lat2, lon2):
+
+        # Convert decimal degrees to radians
+        lat1, lon1, lat2, lon2 = map(radians, [ lat1, lon1, lat2, lon2 ])
+
+        # Haversine formula
+        dlat = abs(lat2 - lat1)
+        dlon = abs(lon2 - lon1)
+        a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
+        c = 2 * asin(sqrt(a))
+        km = c * 6367
+        return km
+
+    #
+    # Get the weather information from http://xml.buienradar.nl
+    #
+
+    def getBuienradarXML(self, file = ''):
+
+        if file != '':
+            self.setFeed(self.parseFeed(file))
+            return
+
+        self.setFeed(self.fetchFeed())
+
+    #
+    # Get the feed without changing this instance, so it can be called
+    # from another thread. A shared feed is used when it is not older than
+    # maxAge seconds, by default the interval. Returns a Feed or None
+    #
+
+    def fetchFeed(self, maxAge=None):
+
+        if maxAge == None:
+            maxAge = self._interval * 60 - FEED_TTL_MARGIN
+
+        # All the instances share the feed, so it is downloaded and parsed
+        # only once per refresh period, however many locations are used
+        return getSharedFeed(FEED_URL, maxAge, self.downloadFeed)
+
+    #
+    # Download and parse the feed, returns a Feed or None
+    #
+
+    def downloadFeed(self):
+
+        download = self.openFeed()
+        if download == None:
+            return None
+
+        # Not modified since the last download, no need to parse it again
+        if download is NOT_MODIFIED:
+            logger.log('Weather data has not changed since the last download')
+            feed = _feedCache.get(FEED_URL)
+            if feed != None:
+                feed.fetched = time.monotonic()
+                return feed
+            if self._cache == None:
+                return None
+
+            xml = self._cache.load()
+            feed = self.parseFeed(io.BytesIO(xml)) if xml != None else None
+
+            # The copy on disk is broken, download all of it next time
+            if feed == None:
+                self._cache.forget()
+            return feed
+
+        # Only keep a copy on disk that could be parsed, otherwise the
+        # conditional requests would keep using a broken copy
+        url, response = download
+        feed = self.parseFeed(io.BytesIO(response.body))
+        if feed != None and self._cache != None:
+            self._cache.save(url, response.body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return feed
+
+    #
+    # Download the feed from the main or backup URL, whichever answers first.
+    # Uses a conditional request when there is a cached copy.
+    # Returns the URL and the response, NOT_MODIFIED or None
+    #
+
+    def openFeed(self):
+
+        try:
+            logger.log('Retrieve weather data from {}', FEED_URL)
+            with stats.timed('download'):
+                url, response = client.getHedged([ FEED_URL, FEED_URL_BACKUP ], self.conditionalHeaders)
+        except HttpError as e:
+            logger.error("Error: {}", e)
+            return None
+
+        if response.status == 304:
+            stats.count('notModified')
+            return NOT_MODIFIED
+
+        return url, response
+
+    def conditionalHeaders(self, url):
+
+        if self._cache == None:
+            return {}
+        return self._cache.conditionalHeaders(url)
+
+    #
+    # Use the copy of the feed on disk, to fill the devices right after a restart.
+    # A copy older than the interval is not used, its observations are too old.
+    #
+
+    def loadCachedFeed(self):
+
+        if self._cache == None:
+            return False
+
+        body = self._cache.load(self._interval * 60)
+        if body == None:
+            return False
+
+        feed = self.parseFeed(io.BytesIO(body))
+        if feed == None:
+            return False
+
+        # Make sure it will be refreshed by the next getBuienradarXML()
+        feed.fetched = float('-inf')
+        with _feedLock:
+            feed = _feedCache.setdefault(FEED_URL, feed)
+
+        self.setFeed(feed)
+        return True
+
+    #
+    # Parse the feed from a file name or file object, returns a Feed or None
+    #
+
+    def parseFeed(self, source):
+
+        with stats.timed('parse'):
+            try:
+                if self._streaming:
+                    stations, forecast = self.parseStream(source)
+                else:
+                    tree = ET.parse(source)
+                    stations = [ self.elementToRecord(station, STATION_FIELDS) for station in tree.iterfind(STATIONS_PATH) ]
+                    forecast = None
+                    for prediction in tree.iterfind(FORECAST_PATH):
+                        forecast = self.elementToRecord(prediction, FORECAST_FIELDS)
+                        break
+            except ET.ParseError as err:
+                logger.log("XML parsing error: {}", err)
+                stats.count('parseErrors')
+                return None
+
+            return self.buildFeed(stations, forecast)
+
+    #
+    # Use the given feed for this location
+    #
+
+    def setFeed(self, feed):
+
+        self.feed = feed
+        self.fieldStations = None
+        if feed == None:
+            self.stationIndex = None
+            self.spatialIndex = None
+            self.forecast = None
+        else:
+            self.stationIndex = feed.stationIndex
+            self.spatialIndex = feed.spatialIndex
+            self.forecast = feed.forecast
+
+    #
+    # Parse the feed with iterparse, only keep the weather stations and
+    # the forecast of today as small records and throw the rest away
+    #
+
+    def parseStream(self, source):
+
+        stations = []
+        forecast = None
+        record = None
+        depth = 0
+
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+
+            if event == 'start':
+                if elem.tag == 'weerstation' or elem.tag == 'verwachting_vandaag':
+                    record = {}
+                    depth = 0
+                elif record != None:
+                    depth += 1
+                continue
+
+            if elem.tag == 'weerstation' and record != None:
+                record['id'] = elem.get('id')
+                stations.append(record)
+                record = None
+            elif elem.tag == 'verwachting_vandaag' and record != None:
+                forecast = record
+                record = None
+            elif record != None:
+                # Only direct children of the record are kept
+                if depth == 1 and (elem.tag in STATION_FIELDS or elem.tag in FORECAST_FIELDS):
+                    record[elem.tag] = elem.text
+                depth -= 1
+                continue
+
+            elem.clear()
+
+        return stations, forecast
+
+    #
+    # Convert a weather station element of the tree to a record
+    #
+
+    def elementToRecord(self, elem, fields):
+
+        record = {}
+        for child in elem:
+            if child.tag in fields:
+                record[child.tag] = child.text
+        record['id'] = elem.get('id')
+        return record
+
+    #
+    # Build the index of all the weather stations in one pass
+    #
+
+    def buildFeed(self, records, forecast):
+
+        index = {}
+        for record in records:
+            station = self.parseStation(record)
+            index[station.id] = station
+
+        return Feed(index, SpatialIndex(index.values()), forecast)
+
+    #
+    # Convert a record to a weather station with typed values
+    #
+
+    def parseStation(self, record):
+
+        return WeatherStation(
+            id              = record.get('id'),
+            code            = record.get('stationcode'),
+            name            = record.get('stationnaam'),
+            lat             = self.parseFloatValue(record.get('lat')),
+            lon             = self.parseFloatValue(record.get('lon')),
+            datum           = record.get('datum'),
+            temperature     = self.parseFloatValue(record.get('temperatuurGC')),
+            windSpeed       = self.parseFloatValue(record.get('windsnelheidMS')),
+            windBearing     = self.parseFloatValue(record.get('windrichtingGR')),
+            windSpeedGusts  = self.parseFloatValue(record.get('windstotenMS')),
+            pressure        = self.parseFloatValue(record.get('luchtdruk')),
+            humidity        = self.parseIntValue(record.get('luchtvochtigheid')),
+            visibility      = self.parseIntValue(record.get('zichtmeters')),
+            solarIrradiance = self.parseFloatValue(record.get('zonintensiteitWM2')),
+            rainRate        = self.parseFloatValue(record.get('regenMMPU')))
+
+    #
+    # Get the record of the forecast of today
+    #
+
+    def getForecastRecord(self):
+
+        return self.forecast
+
+    #
+    # Find the weather station nearby
+    #
+
+    def getNearbyWeatherStation(self):
+
+        # Is the station index set?
+        if self.stationIndex == None:
+            logger.log('No XML file found, try again later')
+            return
+
+        ### Check if XML contains weather stations
+        if len(self.stationIndex) > 0:
+            logger.debug('XML file contains weather station information')
+        else:
+            logger.log('XML file contains no weather station information, try again later')
+            return
+
+        # Start distance far away
+        distance = 10000.0
+        self.stationID = ""
+        self.fieldStations = None
+
+        # If no is temperature set, skip this entry
+        # Many weather stations only measure wind speed
+        # They are not useful for weather information in domoticz
+        with stats.timed('nearest'):
+            nearby = self.nearest(self._lat, self._lon, 1, ('temperature',))
+        for dist, station in nearby:
+            distance = dist
+            self.stationID = station.id
+
+            # This is the station nearby
+            logger.log('Found {} (ID: {}) at {:.1f} km from your home location', station.name, station.code, distance)
+
+        # Check if location is outside of The Netherlands
+        if distance > 100:
+            logger.log("Your location ({},{}) is too far away...", self._lat, self._lon)
+            logger.log("This plugin only works for locations within The Netherlands")
+            self.stationID = ""
+
+    #
+    # The station that supplies each of the FALLBACK_FIELDS: the station nearby
+    # when it reports the field, otherwise the nearest station that does.
+    # Looked up once for every feed.
+    #
+
+    def getFieldStations(self):
+
+        if self.fieldStations != None:
+            return self.fieldStations
+
+        station = self.stationIndex.get(self.stationID)
+        fieldStations = {}
+        with stats.timed('nearest'):
+            for field, name in FALLBACK_FIELDS.items():
+                if station != None and getattr(station, field) != None:
+                    fieldStations[field] = station.id
+                    continue
+
+                for dist, supplier in self.nearest(self._lat, self._lon, 1, (field,)):
+                    fieldStations[field] = supplier.id
+
+                    # Only tell when another station is used
+                    if self._loggedSources.get(field) != supplier.id:
+                        logger.log("No {} info found in your weather station, getting it from {} (ID: {}) at {:.1f} km",
+                                   name, supplier.name, supplier.code, dist)
+
+        self._loggedSources = fieldStations
+        self.fieldStations = fieldStations
+        return fieldStations
+
+    #
+    # Find the k weather stations nearest to a location that report all the
+    # given fields of WeatherStation. Returns a list of (distance in km, station)
+    #
+
+    def nearest(self, lat, lon, k=1, fields=()):
+
+        if self.spatialIndex == None:
+            return []
+
+        return self.spatialIndex.nearest(lat, lon, k, fields)
+
+    #
+    # Parse an int and return None if no int is given
+    #
+
+    def parseIntValue(self, s):
+
+        try:
+            return int(s)
+        except:
+            return None
+
+    #
+    # Parse the date and time of an observation and return None if it is not valid
+    #
+
+    def parseDateValue(self, s):
+
+        try:
+            return datetime.strptime(s, '%m/%d/%Y %H:%M:%S')
+        except (TypeError, ValueError):
+            return None
+
+    #
+    # Parse a float and return None if no float is given
+    #
+
+    def parseFloatValue(self, s):
+
+        try:
+            return float(s)
+        except:
+            return None
+
+    #
+    # The derived values of the current observation
+    #
+
+    def getWindChill(self):
+        return self.observation.getWindChill()
+
+    def getWindDirection(self):
+        return self.observation.getWindDirection()
+
+    def getBarometerForecast(self):
+        return self.observation.getBarometerForecast()
+
+    def getHumidityStatus(self):
+        return self.observation.getHumidityStatus()
+
     #
     # Retrieve all the weather data from the nearby weather station
     #
 
     def getWeather(self):
 
-        #Reset rain counter if it is a new day.
-        if (datetime.now() - timedelta(minutes=self._interval)).day != datetime.now().day:
-            self.rainToday = 0
-
-        # Is the tree set?
-        if self.tree == None:
+        # Is the station index set?
+        if self.stationIndex == None:
             return False
 
         # Was the station set properly?
         if self.stationID == "":
             return False
 
-        # Reset all the weather data
-        self.resetWeatherValues()
-
         # Get the weather information from the station
-        for station in self.tree.iterfind('weergegevens/actueel_weer/weerstations/weerstation[@id=\''+ self.stationID +'\']'):
-
-            #self.observationDate   = datetime.strptime(station.find('datum').text, '%m/%d/%Y %H:%M:%S')
-            self.temperature        = self.parseFloatValue(station.find('temperatuurGC').text)
-            self.windSpeed          = self.parseFloatValue(station.find('windsnelheidMS').text)
-            self.windBearing        = self.parseFloatValue(station.find('windrichtingGR').text)
-            self.windSpeedGusts     = self.parseFloatValue(station.find('windstotenMS').text)
-            self.pressure           = self.parseFloatValue(station.find('luchtdruk').text)
-            self.humidity           = self.parseIntValue(station.find('luchtvochtigheid').text)
-            self.visibility         = self.parseIntValue(station.find('zichtmeters').text)
-            self.solarIrradiance    = self.parseFloatValue(station.find('zonintensiteitWM2').text)
-            self.rainRate           = self.parseFloatValue(station.find('regenMMPU').text)
-            if self.rainRate == None:
-                self.rainRate = 0
-            self.rainToday          += round(self.rainRate * (self._interval/60),1)
-
-            if self.pressure == None and self.visibility == None:
-                Domoticz.Log("No Barometer and Visibility info found in your weather station, getting info from weather station De Bilt")
-            elif self.pressure == None:
-                Domoticz.Log("No Barometer info found in your weather station, getting Barometer info from weather station De Bilt")
-            elif self.visibility == None:
-                Domoticz.Log("No Visibility info found in your weather station, getting visibility info from weather station De Bilt")
-            
-            if self.pressure == None:
-                for station in self.tree.iterfind('weergegevens/actueel_weer/weerstations/weerstation[@id=\''+ self.stationIDbackup +'\']'):
-                    self.pressure = self.parseFloatValue(station.find('luchtdruk').text)
-
-            if self.visibility == None:
-                for station in self.tree.iterfind('weergegevens/actueel_weer/weerstations/weerstation[@id=\''+ self.stationIDbackup +'\']'):
-                    self.visibility = self.parseFloatValue(station.find('zichtmeters').text)
-
-            #Domoticz.Log("Observation: " + str(self.observationDate))
-            Domoticz.Log("Temperature: " + str(self.temperature))
-            Domoticz.Log("Wind Speed: " + str(self.windSpeed) + " | Wind Bearing: " + str(self.windBearing) + " | Wind Direction: " + self.getWindDirection() +
-                         " | Wind Speed Gusts: " + str(self.windSpeedGusts) + " | Wind Chill: " + str(self.getWindChill()))
-            Domoticz.Log("Barometer: " + str(self.pressure) + " | Barometer Forecast: " + str(self.getBarometerForecast()))
-            Domoticz.Log("Humidity: " + str(self.humidity) + " | Humidity status: " + str(self.getHumidityStatus()))
-            Domoticz.Log("Visibility: " + str(self.visibility))
-            Domoticz.Log("Solar Irradiance: " + str(self.solarIrradiance))
-            Domoticz.Log("Rain rate: " + str(self.rainRate))
-            Domoticz.Log("Todays rain is " + str(self.rainToday) + " mm")
-
-            self.lastUpdate = datetime.now()
-
-            #return True
-
-        for prediction in self.tree.iterfind('weergegevens/verwachting_vandaag'):
-            self.weatherForecast = prediction.find('titel').text
-            if len(self.weatherForecast) > 200:
-                self.weatherForecast[0:200]
-            self.weatherFCDateTime = prediction.find('tijdweerbericht').text
-            Domoticz.Log("Weather prediction today: " + str(self.weatherForecast) + " (" + str(self.weatherFCDateTime) + ")")
-            
+        values = dict.fromkeys(Observation._fields)
+        values['stationID'] = self.stationID
+
+        station = self.stationIndex.get(self.stationID)
+        if station != None:
+
+            values['observationDate']   = self.parseDateValue(station.datum)
+            values['windSpeed']         = station.windSpeed
+            values['windBearing']       = station.windBearing
+            values['windSpeedGusts']    = station.windSpeedGusts
+            values['humidity']          = station.humidity
+
+            # The others come from the nearest station that reports them
+            values['sources'] = self.getFieldStations()
+            for field, stationID in values['sources'].items():
+                values[field] = getattr(self.stationIndex[stationID], field)
+
+            if values['rainRate'] == None:
+                values['rainRate'] = 0
+
+        # Add the rain since the last observation, the same observation
+        # can be read more than once but is only counted once. The totals
+        # belong to the location, so they go on when another station
+        # starts to supply a field.
+        daily = self.daily
+        if values['observationDate'] != None:
+            daily.add(values['observationDate'], values['rainRate'], values['temperature'], values['windSpeedGusts'])
+
+        # The totals of today, they start again at midnight
+        values['rainToday'] = round(daily.rainToday(), 1)
+        if daily.day == datetime.now().date():
+            values['minTemperatureToday']   = daily.minTemperature
+            values['maxTemperatureToday']   = daily.maxTemperature
+            values['maxGustsToday']         = daily.maxGusts
+
+        # Keep the observation in the history of the location, to follow the trends
+        if values['observationDate'] != None:
+            history = self.history
+            history.add(values['observationDate'].timestamp(), Observation(**values))
+            values['pressureTendency'] = history.tendency('pressure', 3 * 60 * 60)
+            values['temperatureChange'] = history.tendency('temperature', 60 * 60)
+
+        prediction = self.getForecastRecord()
+        if prediction != None:
+            forecast = prediction.get('titel')
+            if forecast != None and len(forecast) > 200:
+                forecast = forecast[0:200]
+            values['weatherForecast'] = forecast
+            values['weatherFCDateTime'] = prediction.get('tijdweerbericht')
+
+        # Publish the new observation in one go
+        observation = Observation(**values)
+        self.observation = observation
+
+        # The derived values are only calculated when they are logged
+        if station != None and logger.isEnabled(logger.INFO):
+            logger.log("Observation: {}", observation.observationDate)
+            logger.log("Temperature: {}", observation.temperature)
+            logger.log("Wind Speed: {} | Wind Bearing: {} | Wind Direction: {} | Wind Speed Gusts: {} | Wind Chill: {}",
+                       observation.windSpeed, observation.windBearing, observation.getWindDirection(),
+                       observation.windSpeedGusts, observation.getWindChill())
+            logger.log("Barometer: {} | Barometer Forecast: {}", observation.pressure, observation.getBarometerForecast())
+            logger.debug("Pressure tendency: {} hPa/3h | Temperature change: {} C/h", observation.pressureTendency, observation.temperatureChange)
+            logger.log("Humidity: {} | Humidity status: {}", observation.humidity, observation.getHumidityStatus())
+            logger.log("Visibility: {}", observation.visibility)
+            logger.log("Solar Irradiance: {}", observation.solarIrradiance)
+            logger.log("Rain rate: {}", observation.rainRate)
+            logger.debug("Stations by field: {}", observation.sources)
+            logger.log("Todays rain is {} mm", observation.rainToday)
+            logger.debug("Today: temperature {} - {} | Wind Speed Gusts: {}",
+                         observation.minTemperatureToday, observation.maxTemperatureToday, observation.maxGustsToday)
+
+        if prediction != None:
+            logger.log("Weather prediction today: {} ({})", observation.weatherForecast, observation.weatherFCDateTime)
             return True
 
         return False
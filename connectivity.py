@@ -0,0 +1,66 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Keep track of the internet connection by looking at the result of
+#   the real downloads from Buienradar, instead of probing another site.
+#   While offline the time between the attempts doubles every time.
+#
+
+import time
+
+# Seconds to wait before the first retry and the maximum wait
+BACKOFF_MIN = 60
+BACKOFF_MAX = 30 * 60
+
+class ConnectivityTracker:
+
+    def __init__(self, backoffMin=BACKOFF_MIN, backoffMax=BACKOFF_MAX):
+        self._backoffMin    = backoffMin
+        self._backoffMax    = backoffMax
+        self.online         = True
+        self.failures       = 0         # Number of failed attempts in a row
+        self.nextAttempt    = 0         # When to try again while offline
+
+    #
+    # Record the result of a download.
+    # Returns True when the connection went up or down because of it.
+    #
+
+    def record(self, success):
+
+        if success:
+            changed = not self.online
+            self.online = True
+            self.failures = 0
+            self.nextAttempt = 0
+            return changed
+
+        changed = self.online
+        self.online = False
+        self.failures += 1
+        self.nextAttempt = time.monotonic() + self.backoff()
+        return changed
+
+    #
+    # Seconds to wait after the last failure
+    #
+
+    def backoff(self):
+
+        if self.failures == 0:
+            return 0
+        return min(self._backoffMax, self._backoffMin * 2 ** min(self.failures - 1, 16))
+
+    #
+    # Is it time to try to download again?
+    #
+
+    def canTry(self):
+
+        return self.online or time.monotonic() >= self.nextAttempt
@@ -0,0 +1,129 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Keep the last downloaded copy of a feed on disk, together with its
+#   ETag and Last-Modified headers. They are used for conditional requests
+#   and to fill the devices right after a restart of Domoticz.
+#
+
+import json
+import os
+import time
+from datetime import datetime
+import logger
+
+class DiskCache:
+
+    def __init__(self, folder, name):
+        self._bodyFile      = os.path.join(folder, name + '.cache')
+        self._headerFile    = os.path.join(folder, name + '.cache.json')
+        self.url            = None
+        self.etag           = None
+        self.lastModified   = None
+        self.loadHeaders()
+
+    #
+    # Read the headers of the cached copy
+    #
+
+    def loadHeaders(self):
+
+        try:
+            with open(self._headerFile, 'r') as f:
+                headers = json.load(f)
+            self.url            = headers.get('url')
+            self.etag           = headers.get('etag')
+            self.lastModified   = headers.get('lastModified')
+        except (OSError, ValueError):
+            self.url = self.etag = self.lastModified = None
+
+    #
+    # The headers for a conditional request of the URL
+    #
+
+    def conditionalHeaders(self, url):
+
+        headers = {}
+        if url != self.url:
+            return headers
+
+        if self.etag != None:
+            headers['If-None-Match'] = self.etag
+        if self.lastModified != None:
+            headers['If-Modified-Since'] = self.lastModified
+        return headers
+
+    #
+    # Read the cached body, returns None if there is none or when it was
+    # saved more than maxAge seconds ago
+    #
+
+    def load(self, maxAge=None):
+
+        try:
+            if maxAge != None and time.time() - os.path.getmtime(self._bodyFile) > maxAge:
+                logger.debug("Cache file {} is too old to use", self._bodyFile)
+                return None
+            with open(self._bodyFile, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    #
+    # When the cached body was saved, None if there is none
+    #
+
+    def saved(self):
+
+        try:
+            return datetime.fromtimestamp(os.path.getmtime(self._bodyFile))
+        except OSError:
+            return None
+
+    #
+    # Store a downloaded body and its headers
+    #
+
+    def save(self, url, body, etag, lastModified):
+
+        try:
+            self.writeFile(self._bodyFile, body)
+            headers = { 'url': url, 'etag': etag, 'lastModified': lastModified }
+            self.writeFile(self._headerFile, json.dumps(headers).encode('utf-8'))
+        except OSError as e:
+            logger.error("Unable to write cache file: {}", e)
+            return
+
+        self.url            = url
+        self.etag           = etag
+        self.lastModified   = lastModified
+
+    #
+    # Forget the headers of a copy that can not be used, so the next request
+    # is not conditional and downloads the whole body again
+    #
+
+    def forget(self):
+
+        self.url = self.etag = self.lastModified = None
+        try:
+            os.remove(self._headerFile)
+        except OSError:
+            pass
+
+    #
+    # Replace a file in one go, so a crash never leaves half a file behind
+    #
+
+    def writeFile(self, fileName, data):
+
+        tmpFile = fileName + '.tmp'
+        with open(tmpFile, 'wb') as f:
+            f.write(data)
+        os.replace(tmpFile, fileName)
@@ -8,7 +8,7 @@
 #   https://www.buienradar.nl/overbuienradar/gratis-weerdata
 #
 #   Very simple module to make local testing easier
-#   It "emulates" Domoticz.Log() and Domoticz.Debug()
+#   It "emulates" Domoticz.Log(), Domoticz.Debug() and the devices
 #
 
 def Log(s):
@@ -19,3 +19,46 @@ def Debug(s):
 
 def Error(s):
     print(s)
+
+def Debugging(level):
+    pass
+
+def Heartbeat(seconds):
+    pass
+
+# The devices of the plugin by unit, like the Devices that Domoticz gives the plugin
+Devices = {}
+
+class Device:
+
+    def __init__(self, Name, Unit, TypeName="", Used=0, **kwargs):
+        self.Name       = Name
+        self.Unit       = Unit
+        self.TypeName   = TypeName
+        self.Used       = Used
+        self.ID         = Unit
+        self.DeviceID   = str(Unit)
+        self.nValue     = 0
+        self.sValue     = ""
+        self.LastLevel  = 0
+        self.Image      = 0
+
+    def __str__(self):
+        return self.Name
+
+    def Create(self):
+        Devices[self.Unit] = self
+
+    def Update(self, nValue=0, sValue="", Image=None, **kwargs):
+        self.nValue = nValue
+        self.sValue = sValue
+        if Image != None:
+            self.Image = Image
+
+class Image:
+
+    def __init__(self, Filename):
+        self.Filename = Filename
+
+    def Create(self):
+        pass
@@ -0,0 +1,113 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Download and parse the data in a background thread, so a slow
+#   Buienradar site never blocks the heartbeat of the plugin.
+#   The result is published as an immutable snapshot that the
+#   heartbeat picks up when it is ready.
+#
+
+import threading
+import time
+from collections import namedtuple
+import logger
+
+# The data of one fetch, never changed after it is created
+Snapshot = namedtuple('Snapshot', [ 'feed', 'rain', 'created' ])
+
+class BackgroundFetcher:
+
+    def __init__(self, job, name='Buienradar fetcher'):
+        self._job           = job           # Function that returns a Snapshot
+        self._name          = name
+        self._thread        = None
+        self._wake          = threading.Event()
+        self._stopping      = False
+        self._lock          = threading.Lock()
+        self._latest        = None          # Last published snapshot
+        self._dataCreated   = None          # When the last snapshot with data was created
+        self._taken         = True          # Has the last snapshot been taken?
+        self.busy           = False         # Is a fetch in progress?
+        self.started        = None          # When the fetch in progress started
+
+    def start(self):
+
+        if self._thread != None:
+            return
+
+        self._stopping = False
+        self._thread = threading.Thread(name=self._name, target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+
+        if self._thread == None:
+            return
+
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    #
+    # Ask for a fetch, ignored when one is already in progress
+    #
+
+    def request(self):
+
+        if not self.busy:
+            self._wake.set()
+
+    #
+    # Get the snapshot when it has not been taken yet, otherwise None
+    #
+
+    def take(self):
+
+        with self._lock:
+            if self._taken:
+                return None
+            self._taken = True
+            return self._latest
+
+    #
+    # How many seconds old is the last snapshot with data, None when there is none
+    #
+
+    def staleness(self):
+
+        created = self._dataCreated
+        if created == None:
+            return None
+        return time.monotonic() - created
+
+    def _run(self):
+
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopping:
+                return
+
+            self.busy = True
+            self.started = time.monotonic()
+            try:
+                snapshot = self._job()
+            except Exception as e:
+                logger.error("Error while fetching the weather data: {}", e)
+                snapshot = None
+            finally:
+                self.busy = False
+
+            if snapshot != None:
+                with self._lock:
+                    self._latest = snapshot
+                    self._taken = False
+                    if snapshot.feed != None or snapshot.rain != None:
+                        self._dataCreated = snapshot.created
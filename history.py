@@ -0,0 +1,225 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   History of the recent observations of a weather station.
+#   The observations are kept in a ring buffer of typed arrays with a
+#   fixed capacity, so the memory use does not grow however long the
+#   plugin runs. The minimum, maximum, mean and the trend of every
+#   field are updated with each observation, without scanning the
+#   history again.
+#
+
+import math
+from array import array
+from collections import deque
+
+# Seconds of observations that are kept
+HISTORY_WINDOW      = 3 * 60 * 60
+
+# Maximum number of observations that are kept, Buienradar updates
+# every 10 minutes and the shortest interval of the plugin is 5 minutes
+HISTORY_CAPACITY    = 64
+
+# The fields of an observation that are kept
+HISTORY_FIELDS      = ('temperature', 'pressure', 'humidity', 'windSpeed', 'rainRate')
+
+#
+# Rolling statistics of one field, missing values are not counted
+#
+
+class RollingStats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count      = 0
+        self.sumT       = 0.0       # The times are relative to the base of the history
+        self.sumTT      = 0.0
+        self.sumV       = 0.0
+        self.sumTV      = 0.0
+        self.minimum    = deque()   # (sequence, value) with increasing values
+        self.maximum    = deque()   # (sequence, value) with decreasing values
+
+    def add(self, seq, t, value):
+
+        self.count += 1
+        self.sumT += t
+        self.sumTT += t * t
+        self.sumV += value
+        self.sumTV += t * value
+
+        # A value that is not the lowest any more before it leaves the window is never needed
+        while len(self.minimum) > 0 and self.minimum[-1][1] >= value:
+            self.minimum.pop()
+        self.minimum.append((seq, value))
+        while len(self.maximum) > 0 and self.maximum[-1][1] <= value:
+            self.maximum.pop()
+        self.maximum.append((seq, value))
+
+    def remove(self, seq, t, value):
+
+        self.count -= 1
+        self.sumT -= t
+        self.sumTT -= t * t
+        self.sumV -= value
+        self.sumTV -= t * value
+
+        if len(self.minimum) > 0 and self.minimum[0][0] == seq:
+            self.minimum.popleft()
+        if len(self.maximum) > 0 and self.maximum[0][0] == seq:
+            self.maximum.popleft()
+
+    #
+    # Least squares slope in units per second, None when it can not be calculated
+    #
+
+    def slope(self):
+
+        if self.count < 2:
+            return None
+        variance = self.count * self.sumTT - self.sumT * self.sumT
+        if variance <= 0:
+            return None
+        return (self.count * self.sumTV - self.sumT * self.sumV) / variance
+
+class ObservationHistory:
+
+    def __init__(self, fields=HISTORY_FIELDS, window=HISTORY_WINDOW, capacity=HISTORY_CAPACITY):
+        self.fields     = tuple(fields)
+        self.window     = window                # Seconds
+        self.capacity   = capacity
+        self._times     = array('d', [ 0.0 ]) * capacity
+        self._columns   = { field: array('d', [ math.nan ]) * capacity for field in self.fields }
+        self._stats     = { field: RollingStats() for field in self.fields }
+        self._first     = 0                     # Sequence number of the oldest observation
+        self._next      = 0                     # Sequence number of the next observation
+        self._base      = None                  # Timestamp the sums are relative to
+        self._added     = 0                     # Observations added since the sums were calculated
+
+    def __len__(self):
+        return self._next - self._first
+
+    #
+    # Add an observation at the timestamp in seconds, the values are read
+    # from the attributes of the observation with the names of the fields.
+    # Returns False when it is not newer than the last observation.
+    #
+
+    def add(self, timestamp, observation):
+
+        if len(self) > 0 and timestamp <= self._times[(self._next - 1) % self.capacity]:
+            return False
+
+        # Make room, and forget the observations that are too old
+        if len(self) == self.capacity:
+            self._removeOldest()
+        while len(self) > 0 and self._times[self._first % self.capacity] <= timestamp - self.window:
+            self._removeOldest()
+
+        # The sums get less accurate with every add and remove, and with
+        # times far from the base, so now and then calculate them again
+        if self._base == None or self._added >= self.capacity:
+            self._recalculate(timestamp)
+
+        seq = self._next
+        pos = seq % self.capacity
+        self._next += 1
+        self._added += 1
+        self._times[pos] = timestamp
+
+        t = timestamp - self._base
+        for field in self.fields:
+            value = getattr(observation, field, None)
+            if value == None:
+                self._columns[field][pos] = math.nan
+            else:
+                self._columns[field][pos] = value
+                self._stats[field].add(seq, t, float(value))
+
+        return True
+
+    #
+    # The statistics of a field, None when there are no values
+    #
+
+    def latest(self, field):
+
+        column = self._columns[field]
+        for seq in range(self._next - 1, self._first - 1, -1):
+            value = column[seq % self.capacity]
+            if not math.isnan(value):
+                return value
+        return None
+
+    def minimum(self, field):
+
+        stats = self._stats[field]
+        return stats.minimum[0][1] if len(stats.minimum) > 0 else None
+
+    def maximum(self, field):
+
+        stats = self._stats[field]
+        return stats.maximum[0][1] if len(stats.maximum) > 0 else None
+
+    def mean(self, field):
+
+        stats = self._stats[field]
+        return stats.sumV / stats.count if stats.count > 0 else None
+
+    #
+    # The change of a field in the given number of seconds, following the
+    # trend of the observations. None when the observations do not cover
+    # at least half of that period.
+    #
+
+    def tendency(self, field, seconds):
+
+        if self.span() < seconds / 2:
+            return None
+
+        slope = self._stats[field].slope()
+        if slope == None:
+            return None
+        return slope * seconds
+
+    #
+    # Seconds between the oldest and the newest observation
+    #
+
+    def span(self):
+
+        if len(self) < 2:
+            return 0
+        return self._times[(self._next - 1) % self.capacity] - self._times[self._first % self.capacity]
+
+    def _removeOldest(self):
+
+        seq = self._first
+        pos = seq % self.capacity
+        self._first += 1
+
+        t = self._times[pos] - self._base
+        for field in self.fields:
+            value = self._columns[field][pos]
+            if not math.isnan(value):
+                self._stats[field].remove(seq, t, value)
+
+    def _recalculate(self, base):
+
+        self._base = base
+        self._added = 0
+        for field in self.fields:
+            stats = self._stats[field]
+            stats.reset()
+            column = self._columns[field]
+            for seq in range(self._first, self._next):
+                pos = seq % self.capacity
+                if not math.isnan(column[pos]):
+                    stats.add(seq, self._times[pos] - base, column[pos])
@@ -0,0 +1,331 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Small HTTP client shared by all downloads of the plugin.
+#   It keeps the connections to each host open for the next request,
+#   uses separate connect and read timeouts, asks for compressed
+#   responses and adds the latency per host to the statistics.
+#
+#   With getHedged() the next URL is requested when the previous one
+#   did not answer within the latency budget, and the first good
+#   answer is used. The URL that answered fastest is tried first.
+#
+
+import http.client
+import queue
+import socket
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, urljoin
+import logger
+import stats
+
+# Default timeouts in seconds
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT    = 10
+
+# Idle connections kept per host
+MAX_IDLE        = 2
+
+# Redirects followed for one request
+MAX_REDIRECTS   = 5
+
+# Seconds to wait for an URL before the next one is requested as well,
+# None to only request the next one when the previous one failed
+HEDGE_BUDGET    = 2.0
+
+# Weight of the last request in the average latency of an URL
+LATENCY_WEIGHT  = 0.3
+
+#
+# Raised for network errors, timeouts and HTTP status codes of 400 and up
+#
+
+class HttpError(Exception):
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+class Response:
+
+    __slots__ = ('url', 'status', 'reason', 'headers', 'body', 'latency')
+
+    def __init__(self, url, status, reason, headers, body, latency):
+        self.url        = url           # URL of the response, after redirects
+        self.status     = status
+        self.reason     = reason
+        self.headers    = headers       # Case insensitive, use headers.get()
+        self.body       = body          # Decompressed body in bytes
+        self.latency    = latency       # Seconds
+
+class HttpClient:
+
+    def __init__(self, connectTimeout=CONNECT_TIMEOUT, readTimeout=READ_TIMEOUT, hedgeBudget=HEDGE_BUDGET):
+        self.connectTimeout = connectTimeout
+        self.readTimeout    = readTimeout
+        self.hedgeBudget    = hedgeBudget
+        self._lock          = threading.Lock()
+        self._idle          = {}        # (scheme, host, port) -> idle connections
+        self._busy          = set()     # Connections of the requests in progress
+        self._threads       = set()     # Threads of getHedged() that did not finish yet
+        self._closed        = False     # Do new requests fail until reopen()?
+        self.urlLatency     = {}        # URL -> average seconds, failures count as a timeout
+
+    #
+    # Get the URL, returns a Response or raises HttpError
+    #
+
+    def get(self, url, headers=None):
+
+        started = time.monotonic()
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request(url, headers)
+            if response.status in (301, 302, 303, 307, 308) and response.headers.get('Location') != None:
+                url = urljoin(url, response.headers.get('Location'))
+                continue
+            break
+
+        response.latency = time.monotonic() - started
+        self._recordLatency(url, response.latency)
+        stats.count('requests')
+        logger.debug("GET {}: {}, {} bytes in {:.0f} ms", url, response.status, len(response.body), response.latency * 1000)
+
+        if response.status >= 400:
+            raise HttpError("HTTP Error " + str(response.status) + ": " + response.reason, response.status)
+        return response
+
+    #
+    # Get the first good answer of the URLs, starting with the fastest URL.
+    # The next URL is requested when the previous one failed or did not answer
+    # within the budget. headersFor(url) returns the headers for an URL.
+    # Returns (url, Response) or raises HttpError when all URLs failed.
+    #
+
+    def getHedged(self, urls, headersFor=None, budget=None):
+
+        if budget == None:
+            budget = self.hedgeBudget
+
+        # Unknown URLs are tried after the known ones, in the given order
+        main = urls[0]
+        urls = sorted(urls, key=lambda url: self.urlLatency.get(url, float('inf')))
+        results = queue.Queue()
+
+        def fetch(url):
+            started = time.monotonic()
+            try:
+                response = self.get(url, headersFor(url) if headersFor != None else None)
+                self._recordUrlLatency(url, time.monotonic() - started)
+                results.put((url, response, None))
+            except HttpError as e:
+                self._recordUrlLatency(url, self.connectTimeout + self.readTimeout)
+                results.put((url, None, e))
+            finally:
+                with self._lock:
+                    self._threads.discard(threading.current_thread())
+
+        errors = []
+        code = None
+        pending = 0
+        for index, url in enumerate(urls):
+            # The request that loses keeps running, close() waits for it
+            thread = threading.Thread(name='GET ' + url, target=fetch, args=(url,), daemon=True)
+            with self._lock:
+                self._threads.add(thread)
+            thread.start()
+            pending += 1
+            last = index == len(urls) - 1
+
+            while pending > 0:
+                try:
+                    answered, response, error = results.get(timeout=None if last else budget)
+                except queue.Empty:
+                    # Already count it as slow, so the next poll starts with another URL
+                    logger.debug("No answer from {} within {} seconds, also trying {}", url, budget, urls[index + 1])
+                    self._recordUrlLatency(url, budget)
+                    break
+
+                pending -= 1
+                if error == None:
+                    if answered != main:
+                        stats.count('fallback')
+                    return answered, response
+
+                errors.append(str(error) + " URL: " + answered)
+                code = error.code
+                if not last:
+                    break
+
+        stats.count('failed')
+        raise HttpError(", ".join(errors), code if len(errors) == 1 else None)
+
+    #
+    # Break off the requests that are still running, wait for their threads
+    # and close all the idle connections. New requests fail until reopen(),
+    # so a broken off request is not tried again at the next URL.
+    #
+
+    def close(self):
+
+        with self._lock:
+            self._closed = True
+            busy = list(self._busy)
+            threads = list(self._threads)
+
+        for conn in busy:
+            try:
+                if conn.sock != None:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        for thread in threads:
+            thread.join(self.connectTimeout + self.readTimeout)
+
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    #
+    # Accept new requests again after close()
+    #
+
+    def reopen(self):
+
+        with self._lock:
+            self._closed = False
+
+    def _request(self, url, headers):
+
+        if self._closed:
+            raise HttpError("The client is closed")
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        allHeaders = { 'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive' }
+        if headers != None:
+            allHeaders.update(headers)
+
+        # A kept connection may have been closed by the server in the meantime,
+        # in that case try once more with a new connection
+        conn, reused = self._checkout(key)
+        self._setBusy(conn, True)
+        try:
+            try:
+                response = self._send(conn, path, allHeaders)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                self._setBusy(conn, False)
+                conn, reused = self._newConnection(key), False
+                self._setBusy(conn, True)
+                response = self._send(conn, path, allHeaders)
+
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise HttpError(str(e) or e.__class__.__name__)
+        finally:
+            self._setBusy(conn, False)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+
+        # Count the bytes that were downloaded, before they are decompressed
+        stats.count('bytes', len(body))
+        body = self._decode(body, response.getheader('Content-Encoding'))
+        return Response(url, response.status, response.reason, response.msg, body, 0)
+
+    def _send(self, conn, path, headers):
+
+        if conn.sock == None:
+            conn.connect()
+            conn.sock.settimeout(self.readTimeout)
+        conn.request('GET', path, headers=headers)
+        return conn.getresponse()
+
+    def _decode(self, body, encoding):
+
+        if encoding == None:
+            return body
+
+        encoding = encoding.strip().lower()
+        try:
+            if encoding == 'gzip':
+                return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            if encoding == 'deflate':
+                try:
+                    return zlib.decompress(body)
+                except zlib.error:
+                    # Some servers send deflate without the zlib header
+                    return zlib.decompress(body, -zlib.MAX_WBITS)
+        except zlib.error as e:
+            raise HttpError("Unable to decompress response: " + str(e))
+        return body
+
+    def _checkout(self, key):
+
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop(), True
+        return self._newConnection(key), False
+
+    def _setBusy(self, conn, busy):
+
+        with self._lock:
+            if busy:
+                self._busy.add(conn)
+            else:
+                self._busy.discard(conn)
+
+    def _checkin(self, key, conn):
+
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < MAX_IDLE:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def _newConnection(self, key):
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.connectTimeout)
+        return http.client.HTTPConnection(host, port, timeout=self.connectTimeout)
+
+    def _recordUrlLatency(self, url, latency):
+
+        with self._lock:
+            average = self.urlLatency.get(url)
+            if average == None:
+                self.urlLatency[url] = latency
+            else:
+                self.urlLatency[url] = average + LATENCY_WEIGHT * (latency - average)
+
+    def _recordLatency(self, url, latency):
+
+        stats.recordHost(urlsplit(url).hostname, latency)
+
+# The client shared by all the downloads
+client = HttpClient()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Local stand-in for the Buienradar sites, to see how the plugin handles
+#   a slow or failing site. It serves the feed and the rain forecast on
+#   the main and the backup URL, and can make each of them slow, time out,
+#   return an error, break off the body or send malformed data.
+#
+#   ./localserver.py                run the downloads for every scenario
+#   ./localserver.py --heartbeat    run the plugin itself for every scenario
+#   ./localserver.py --serve        only run the server, with the normal scenario
+#
+#   The feed is ./buienradar.xml when it exists, otherwise a generated one.
+#   The rain forecast is ./raintext.txt.
+#
+
+import argparse
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import fakeDomoticz
+import buienradar
+import httpclient
+import rainforecast
+from buienradar import Buienradar, clearFeedCache
+from rainforecast import RainForecast
+
+# What goes wrong with an URL:
+#   ('latency', seconds)    answer after the given number of seconds
+#   ('timeout', None)       answer after the read timeout of the client
+#   ('error', status)       answer with the HTTP status
+#   ('truncated', None)     close the connection halfway the body
+#   ('malformed', None)     send half of the body as if it is all of it
+Fault = namedtuple('Fault', [ 'kind', 'value' ])
+
+# The URLs of the stand-in, relative to the server
+FEED_PATH           = '/'
+FEED_PATH_BACKUP    = '/backup/'
+RAIN_PATH           = '/getrr.php?lat={}&lon={}'
+RAIN_PATH_BACKUP    = '/data/raintext?lat={}&lon={}'
+
+# Read timeout of the client during the tests, in seconds
+READ_TIMEOUT        = 3
+
+# The location of the tests, De Bilt
+HOME_LAT            = 52.101547
+HOME_LON            = 5.177919
+
+# The faults by URL: 'feed', 'feedBackup', 'rain' and 'rainBackup'
+SCENARIOS = {
+    'normal':           {},
+    'slow main':        { 'feed': Fault('latency', 3), 'rain': Fault('latency', 3) },
+    'main timeout':     { 'feed': Fault('timeout', None), 'rain': Fault('timeout', None) },
+    'main 503':         { 'feed': Fault('error', 503), 'rain': Fault('error', 503) },
+    'all 503':          { 'feed': Fault('error', 503), 'feedBackup': Fault('error', 503),
+                          'rain': Fault('error', 503), 'rainBackup': Fault('error', 503) },
+    'main truncated':   { 'feed': Fault('truncated', None), 'rain': Fault('truncated', None) },
+    'all truncated':    { 'feed': Fault('truncated', None), 'feedBackup': Fault('truncated', None),
+                          'rain': Fault('truncated', None), 'rainBackup': Fault('truncated', None) },
+    'malformed':        { 'feed': Fault('malformed', None), 'feedBackup': Fault('malformed', None),
+                          'rain': Fault('malformed', None), 'rainBackup': Fault('malformed', None) },
+}
+
+#
+# Answers the requests like Buienradar, with the faults of the scenario
+#
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+
+        server = self.server
+        if self.path.startswith('/getrr.php'):
+            name, body = 'rain', server.rainText
+        elif self.path.startswith('/data/raintext'):
+            name, body = 'rainBackup', server.rainText
+        elif self.path.startswith(FEED_PATH_BACKUP):
+            name, body = 'feedBackup', server.feed
+        else:
+            name, body = 'feed', server.feed
+
+        server.hits[name] = server.hits.get(name, 0) + 1
+        fault = server.scenario.get(name)
+
+        try:
+            if fault != None and fault.kind == 'latency':
+                time.sleep(fault.value)
+            elif fault != None and fault.kind == 'timeout':
+                time.sleep(READ_TIMEOUT + 1)
+            elif fault != None and fault.kind == 'error':
+                self.send(fault.value, b'Service Unavailable')
+                return
+            elif fault != None and fault.kind == 'truncated':
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[:len(body) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            elif fault != None and fault.kind == 'malformed':
+                body = body[:len(body) // 2]
+
+            self.send(200, body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client did not wait for the answer
+            pass
+
+    def send(self, status, body):
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, feed, rainText, port=0):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.feed       = feed
+        self.rainText   = rainText
+        self.scenario   = {}
+        self.hits       = {}        # Requests by URL name
+        self._thread    = None
+
+    @property
+    def baseUrl(self):
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def start(self):
+
+        self._thread = threading.Thread(name='Stand-in server', target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+        # Let the plugin use the stand-in instead of Buienradar
+        buienradar.FEED_URL = self.baseUrl + FEED_PATH
+        buienradar.FEED_URL_BACKUP = self.baseUrl + FEED_PATH_BACKUP
+        rainforecast.RAIN_URL = self.baseUrl + RAIN_PATH
+        rainforecast.RAIN_URL_BACKUP = self.baseUrl + RAIN_PATH_BACKUP
+
+    def stop(self):
+
+        self.shutdown()
+        self.server_close()
+
+    #
+    # Use another scenario, and forget everything the client learned
+    #
+
+    def use(self, scenario):
+
+        # Requests of the last scenario that were not waited for are broken off
+        httpclient.client.close()
+        httpclient.client.reopen()
+        httpclient.client.urlLatency.clear()
+
+        self.scenario = scenario
+        self.hits = {}
+        clearFeedCache()
+
+def loadFixtures():
+
+    if os.path.isfile('./buienradar.xml'):
+        with open('./buienradar.xml', 'rb') as f:
+            feed = f.read()
+    else:
+        from benchmark import generateFeed
+        feed = generateFeed(50)
+
+    with open('./raintext.txt', 'rb') as f:
+        rainText = f.read()
+
+    return feed, rainText
+
+#
+# Download and parse the feed and the rain forecast
+#
+
+def runDownloads(server, name):
+
+    br = Buienradar(HOME_LAT, HOME_LON)
+    rf = RainForecast(HOME_LAT, HOME_LON)
+
+    started = time.monotonic()
+    br.getBuienradarXML()
+    br.getNearbyWeatherStation()
+    feedTime = time.monotonic() - started
+
+    started = time.monotonic()
+    rain = rf.get_precipfc_data()
+    rainTime = time.monotonic() - started
+
+    print('{:<16} feed {:6.2f} s {:<8} | rain {:6.2f} s {:<8} | requests {}'.format(
+        name, feedTime, 'ok' if br.stationID != "" else 'no data',
+        rainTime, 'ok' if rain != None else 'no data', server.hits))
+
+#
+# Start the plugin and measure the time until the heartbeat shows the data
+#
+
+def runHeartbeat(server, name):
+
+    import plugin
+
+    home = tempfile.mkdtemp() + os.sep
+    plugin.Parameters = { 'Mode1': 'True', 'Mode2': '10', 'Mode3': '30', 'Mode4': 'True',
+                          'Mode5': 'True', 'Mode6': 'Normal', 'HomeFolder': home }
+    plugin.Settings = { 'Location': str(HOME_LAT) + ';' + str(HOME_LON) }
+    plugin.Devices = fakeDomoticz.Devices
+    plugin.Images = {}
+    fakeDomoticz.Devices.clear()
+    plugin._sentPayloads.clear()
+
+    # Know when the background fetches are done
+    jobs = { 'fetchObservations': plugin.fetchObservations, 'fetchRain': plugin.fetchRain }
+    done = { name: threading.Event() for name in jobs }
+
+    def watch(name, job):
+        def run():
+            try:
+                return job()
+            finally:
+                done[name].set()
+        return run
+
+    for jobName, job in jobs.items():
+        setattr(plugin, jobName, watch(jobName, job))
+    try:
+        started = time.monotonic()
+        plugin.onStart()
+        for event in done.values():
+            event.wait(4 * READ_TIMEOUT)
+        fetched = time.monotonic()
+        plugin.onHeartbeat()
+        finished = time.monotonic()
+        online = plugin._plugin.isOnline()
+        plugin.onStop()
+    finally:
+        for jobName, job in jobs.items():
+            setattr(plugin, jobName, job)
+        shutil.rmtree(home, ignore_errors=True)
+
+    print('{:<16} fetch {:6.2f} s | heartbeat {:7.1f} ms | end to end {:6.2f} s | online {:<5} | devices {}'.format(
+        name, fetched - started, (finished - fetched) * 1000, finished - started,
+        str(online), sum(1 for device in fakeDomoticz.Devices.values() if device.sValue != "")))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Buienradar sites')
+    parser.add_argument('--heartbeat', action='store_true', help='measure the heartbeat of the plugin')
+    parser.add_argument('--serve', action='store_true', help='only run the server')
+    parser.add_argument('--port', type=int, default=0, help='port of the server')
+    parser.add_argument('--verbose', action='store_true', help='show the log messages')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        fakeDomoticz.Log = fakeDomoticz.Debug = fakeDomoticz.Error = lambda s: None
+
+    feed, rainText = loadFixtures()
+    server = StandInServer(feed, rainText, args.port)
+    server.start()
+
+    if args.serve:
+        print('Serving on ' + server.baseUrl + ', press Ctrl+C to stop')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    else:
+        httpclient.client.readTimeout = READ_TIMEOUT
+        for name, scenario in SCENARIOS.items():
+            server.use(scenario)
+            if args.heartbeat:
+                runHeartbeat(server, name)
+            else:
+                runDownloads(server, name)
+
+    server.stop()
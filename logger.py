@@ -0,0 +1,103 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Logging of the plugin on top of Domoticz.Log(), Debug() and Error().
+#   The message is only formatted when its level is logged, so pass
+#   the values as arguments instead of adding strings:
+#
+#       logger.debug("Temperature: {} | Humidity: {}", temperature, humidity)
+#
+#   The messages can also be written to a file. They are kept in memory
+#   and written with flush(), the plugin does that once per heartbeat.
+#
+
+try:
+    import Domoticz
+except ImportError:
+    import fakeDomoticz as Domoticz
+
+import threading
+
+# The levels
+DEBUG   = 10
+INFO    = 20
+ERROR   = 40
+
+_level      = DEBUG
+_fileName   = None          # Where the messages are written to, None when they are not
+_buffer     = []            # Messages not written to the file yet
+_lock       = threading.Lock()
+
+#
+# Only log messages of this level and higher
+#
+
+def setLevel(level):
+    global _level
+    _level = level
+
+def isEnabled(level):
+    return level >= _level
+
+#
+# Log a message, the arguments are put in the {} of the message
+#
+
+def debug(message, *args):
+    if DEBUG >= _level:
+        _write(Domoticz.Debug, message, args)
+
+def log(message, *args):
+    if INFO >= _level:
+        _write(Domoticz.Log, message, args)
+
+def error(message, *args):
+    if ERROR >= _level:
+        _write(Domoticz.Error, message, args)
+
+#
+# Also write the messages to a file, None to stop doing that
+#
+
+def setFile(fileName):
+    global _fileName
+    flush()
+    _fileName = fileName
+
+#
+# Write the messages in memory to the file
+#
+
+def flush():
+
+    global _buffer
+    with _lock:
+        if len(_buffer) == 0:
+            return
+        lines = _buffer
+        _buffer = []
+
+    if _fileName == None:
+        return
+
+    try:
+        with open(_fileName, "a") as f:
+            f.write("".join(lines))
+    except OSError as e:
+        Domoticz.Error("Unable to write log file: " + str(e))
+
+def _write(function, message, args):
+
+    if len(args) > 0:
+        message = message.format(*args)
+    function(message)
+
+    if _fileName != None:
+        with _lock:
+            _buffer.append(message + "\r\n")
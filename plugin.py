@@ -15,7 +15,7 @@
 <plugin key="Buienradar" name="Buienradar.nl (Weather lookup)" author="ffes" version="2.5.0" wikilink="https://github.com/ffes/domoticz-buienradar" externallink="https://www.buienradar.nl/overbuienradar/gratis-weerdata">
     <params>
         <param field="Mode2" label="Update every x minutes" width="200px" required="true" default="5"/>
-        <param field="Mode3" label="Rain forecast timeframe in minutes" width="200px" required="true" default="30"/>
+        <param field="Mode3" label="Rain forecast timeframe(s) in minutes, e.g. 30 or 30,60,120" width="200px" required="true" default="30"/>
         <param field="Mode4" label="Temperature and humidity" width="200px" required="true">
             <options>
                 <option label="Combined in one device" value="True" default="true" />
@@ -34,6 +34,7 @@
                 <option label="Average rainrate" value=False/>
             </options>
         </param>
+        <param field="Address" label="Extra locations, e.g. 52.37;4.89,51.44;5.48" width="300px" required="false" default=""/>
         <param field="Mode6" label="Debug" width="100px">
             <options>
                 <option label="True" value="Debug"/>
@@ -50,41 +51,158 @@ try:
 except ImportError:
     import fakeDomoticz as Domoticz
 
-import requests
+import random
+import time
 from math import radians, cos, sin, asin, sqrt
 from datetime import datetime, timedelta
 from buienradar import Buienradar
-from rainforecast import RainForecast
+from rainforecast import RainForecast, get_precipfc_batch
+from fetcher import BackgroundFetcher, Snapshot
+from connectivity import ConnectivityTracker
+from scheduler import PublishScheduler
+import httpclient
+import logger
+import stats
+
+# Units of the rain forecast devices for the extra timeframes
+HORIZON_UNIT    = 12
+MAX_HORIZONS    = 4
+
+# Every extra location gets its own block of units, the location in the
+# Settings uses the first one
+UNITS_PER_LOCATION = 20
+MAX_LOCATIONS   = 12
+
+# Unit of the Text device with the statistics of the plugin, it is created
+# unused so it only shows up in the devices list when it is added
+STATS_UNIT      = 250
+
+# Seconds between the updates of the statistics device and file
+STATS_INTERVAL  = 5 * 60
+
+# The scheduler decides when the feed is downloaded, a feed that is
+# shared with another location is only used when it is this fresh
+SHARED_FEED_AGE = 60
+
+# Seconds between the updates of the rain forecast, it is only downloaded
+# again after rainforecast.RAIN_REFRESH minutes
+RAIN_PERIOD     = 5 * 60
+
+# Seconds onStop() waits for a background download to end, after its
+# requests have been broken off
+STOP_TIMEOUT    = 5
+
+# Every download waits up to this part of its period longer, so not all
+# installations download at the same moment
+JITTER          = 0.1
+
+#
+# A download that runs in its own background thread, with its own period
+# and backoff, so one data source never holds up the other
+#
+
+class Task:
+
+    def __init__(self, name, job, period, jitter=JITTER):
+        self.name       = name
+        self.period     = period            # Seconds between the runs
+        self.jitter     = jitter            # Part of the wait added at random
+        self.fetcher    = BackgroundFetcher(job, name)
+        self.connection = ConnectivityTracker()
+        self.nextRun    = 0                 # time.monotonic() of the next run
+
+    def start(self):
+        self.fetcher.start()
+        self.run()
+
+    def stop(self, timeout=None):
+        self.fetcher.stop(timeout)
+
+    def due(self):
+        return time.monotonic() >= self.nextRun
+
+    #
+    # Start a run, until it is done the next one is after the period
+    #
+
+    def run(self):
+        self.fetcher.request()
+        self.nextRun = time.monotonic() + self.spread(self.period)
+
+    #
+    # Record the result of a run and plan the next one after the given
+    # seconds, the period or the backoff after a failure.
+    # Returns True when the connection went up or down because of it.
+    #
+
+    def done(self, success, delay=None):
+        changed = self.connection.record(success)
+        if not success:
+            delay = self.connection.backoff()
+        elif delay == None:
+            delay = self.period
+        self.nextRun = time.monotonic() + self.spread(delay)
+        return changed
+
+    def spread(self, seconds):
+        return max(0, seconds) * (1 + random.uniform(0, self.jitter))
+
+#
+# A location with its own devices. All the locations use the same feed,
+# each with the weather station nearby and its own rain forecast.
+#
+
+class Location:
+
+    def __init__(self, index, latitude, longitude, interval, timeframe, showMax, horizons, cacheFolder):
+        self.index      = index
+        self.base       = index * UNITS_PER_LOCATION    # Added to the units of the devices
+        self.label      = "" if index == 0 else " " + str(latitude) + ";" + str(longitude)
+        self.horizons   = horizons
+        self.br         = Buienradar(latitude, longitude, interval, streaming=True, cacheFolder=cacheFolder)
+        self.rf         = RainForecast(latitude, longitude, timeframe, showMax, cacheFolder=cacheFolder, horizons=horizons)
+
+    # The unit of a device of this location
+    def unit(self, unit):
+        return self.base + unit
+
+    # The name of a device of this location
+    def name(self, name):
+        return name + self.label
 
 #############################################################################
 #                      Domoticz call back functions                         #
 #############################################################################
 class BasePlugin:
     myLat       = myLon = 0
-    br          = rf = None
     interval    = timeframe = None
+    horizons    = ()
+    observations = rain = None
+    scheduler   = None
+    nextStats   = 0
 
     def onStart(self):
         #pylint: disable=undefined-variable
-        global br, rf
         self.Error = False
 
         self.ShowMax = Parameters["Mode1"]
         if self.ShowMax == "" or self.ShowMax == "True":
             self.ShowMax = True
 
+        # The debug messages are not even formatted when they are not shown
+        if Parameters["Mode6"] == "File":
+            logger.setFile(Parameters["HomeFolder"] + "plugin.log")
         if Parameters["Mode6"] != "Normal":
             Domoticz.Debugging(1)
+            logger.setLevel(logger.DEBUG)
             DumpConfigToLog()
-
-        if CheckInternet() == False:
-            self.Error = "You do not have a working internet connection."
-            #Domoticz.Error(self.Error)
+        else:
+            logger.setLevel(logger.INFO)
 
         # Get the location from the Settings
         if not "Location" in Settings:
         	self.Error = "Location not set in Settings, please update your settings."
-        	Domoticz.Error(self.Error)
+        	logger.error(self.Error)
         
         if self.Error == False:
 
@@ -92,98 +210,168 @@ class BasePlugin:
 	        loc = Settings["Location"].split(";")
 	        self.myLat = float(loc[0])
 	        self.myLon = float(loc[1])
-	        Domoticz.Debug("Coordinates from Domoticz: " + str(self.myLat) + ";" + str(self.myLon))
+	        logger.debug("Coordinates from Domoticz: {};{}", self.myLat, self.myLon)
 
 	        if self.myLat == None or self.myLon == None:
-	            Domoticz.Log("Unable to parse coordinates")
+	            logger.log("Unable to parse coordinates")
 	            return False
 
 	        # Get the interval specified by the user
 	        self.interval = int(Parameters["Mode2"])
 	        if self.interval == None:
-	            Domoticz.Log("Unable to parse interval, so set it to 10 minutes")
+	            logger.log("Unable to parse interval, so set it to 10 minutes")
 	            self.interval = 10
 
 	        # Buienradar only updates the info every 10 minutes.
 	        # Allowing values below 10 minutes will not get you more info
 	        if self.interval < 5:
-	            Domoticz.Log("Interval too small, changed to 5 minutes because Buienradar only updates the info every 5 minutes")
+	            logger.log("Interval too small, changed to 5 minutes because Buienradar only updates the info every 5 minutes")
 	            self.interval = 5
 
-	        # Get the timeframe for the rain forecast
-	        self.timeframe = int(Parameters["Mode3"])
-	        if self.timeframe == None:
-	            Domoticz.Log("Unable to parse timeframe, set to 30 minutes")
-	            self.timeframe = 30
-	        if self.timeframe < 5 or self.timeframe > 120:
-	            Domoticz.Log("Timeframe must be >=5 and <=120. Now set to 30 minutes")
-	            self.timeframe = 30
+	        # Get the timeframe for the rain forecast, optionally followed by
+	        # more timeframes that get their own rain forecast device
+	        timeframes = parseTimeframes(Parameters["Mode3"])
+	        self.timeframe = timeframes[0]
+	        self.horizons = timeframes[1:]
 
-	        br = Buienradar(self.myLat, self.myLon, self.interval)
-	        rf = RainForecast(self.myLat, self.myLon, self.timeframe, self.ShowMax)
+	        # The location in the Settings, followed by the extra locations
+	        coordinates = [ (self.myLat, self.myLon) ] + parseLocations(Parameters.get("Address", ""))
+	        del locations[:]
+	        for index, (lat, lon) in enumerate(coordinates):
+	            locations.append(Location(index, lat, lon, self.interval, self.timeframe, self.ShowMax, self.horizons, Parameters["HomeFolder"]))
 
 	        # Check if devices need to be created
-	        createDevices()
+	        for location in locations:
+	            createDevices(location)
 
 	        # Check if images are in database
 	        if 'BuienradarRainLogo' not in Images: Domoticz.Image('buienradar.zip').Create()
 	        if 'BuienradarLogo' not in Images: Domoticz.Image('buienradar-logo.zip').Create()
 
-	        # Get data from Buienradar
-	        br.getBuienradarXML()
-	        br.getNearbyWeatherStation()
-
-	        # Fill the devices with the Buienradar values
-	        fillDevices()
-
+	        # Fill the devices with the copy of the last run, until the refresh is done
+	        if locations[0].br.loadCachedFeed():
+	            for location in locations:
+	                location.br.setFeed(locations[0].br.feed)
+	                location.br.getNearbyWeatherStation()
+	                if location.rf.load_cache():
+	                    fillDevices(location, location.rf.parse_precipfc_data())
+	                else:
+	                    fillDevices(location)
+
+	        # Get data from Buienradar in the background, the heartbeat picks it up.
+	        # The observations and the rain forecast are downloaded independently
+	        # The client is closed by onStop(), the plugin can be started again
+	        httpclient.client.reopen()
+	        self.scheduler = PublishScheduler(self.interval)
+	        self.observations = Task('Buienradar observations', fetchObservations, self.interval * 60)
+	        self.rain = Task('Buienradar rain forecast', fetchRain, RAIN_PERIOD)
+	        self.observations.start()
+	        self.rain.start()
+
+	        self.nextStats = time.monotonic() + STATS_INTERVAL
 	        Domoticz.Heartbeat(30)
 
     def onHeartbeat(self):
-        if CheckInternet() == False:
-            self.Error = "You do not have a working internet connection."
-            Domoticz.Error(self.Error)
-        elif CheckInternet() == True and self.Error == "You do not have a working internet connection.":
-            self.Error = False
-            Domoticz.Error("Your internet connection is back.")
-
         if self.Error == False:
-            # Does the weather information needs to be updated?
-            global br
-            if br.needUpdate():
-                # Get new information and update the devices
-                br.getBuienradarXML()
-                fillDevices()
+            # The downloads themselves tell if the internet connection works
+            wasOnline = self.isOnline()
+
+            # Did the background fetches get new information? Update the devices
+            snapshot = self.observations.fetcher.take()
+            if snapshot != None:
+                # Keep the data we have when the fetch failed. The feed is
+                # parsed once, every location only looks up its station.
+                for location in locations:
+                    if snapshot.feed != None:
+                        location.br.setFeed(snapshot.feed)
+                    if location.br.stationID == "":
+                        location.br.getNearbyWeatherStation()
+                    fillDevices(location)
+
+                # Plan the next download after the next publication of the station
+                delay = None
+                published = firstObservationDate()
+                if snapshot.feed != None and published != None:
+                    nextFetch = self.scheduler.fetched(published)
+                    delay = (nextFetch - datetime.now()).total_seconds()
+                    logger.debug("Next download of the weather data at {:%H:%M:%S}", nextFetch)
+                self.observations.done(snapshot.feed != None, delay)
+
+            snapshot = self.rain.fetcher.take()
+            if snapshot != None:
+                # The rain forecast of every location, None when its download failed
+                if snapshot.rain != None:
+                    for location, rain in zip(locations, snapshot.rain):
+                        if rain != None:
+                            fillRainDevices(location, rain)
+                self.rain.done(snapshot.rain != None)
+
+            if self.isOnline() != wasOnline:
+                if self.isOnline():
+                    logger.error("Your internet connection is back.")
+                else:
+                    logger.error("You do not have a working internet connection.")
+
+            for task in (self.observations, self.rain):
+                staleness = task.fetcher.staleness()
+                if staleness != None:
+                    logger.debug("{} are {:.0f} seconds old", task.name, staleness)
+
+            # Does the information need to be updated? Keep trying when no weather
+            # data has been received yet, but wait longer and longer after a failure
+            if (locations[0].br.feed == None and self.observations.connection.canTry()) or self.observations.due():
+                self.observations.run()
+            if self.rain.due():
+                self.rain.run()
+
+            # Show where the time went
+            if time.monotonic() >= self.nextStats:
+                self.nextStats = time.monotonic() + STATS_INTERVAL
+                updateStats()
         else:
-            Domoticz.Error(self.Error)
+            logger.error(self.Error)
+
+        # Write the messages of this heartbeat to plugin.log at once
+        logger.flush()
+
+    #
+    # Is at least one of the downloads working?
+    #
+
+    def isOnline(self):
+        return self.observations.connection.online or self.rain.connection.online
+
+    def onStop(self):
+        # Break off the downloads in progress first, otherwise stopping
+        # the tasks waits until they time out
+        httpclient.client.close()
+        for task in (self.observations, self.rain):
+            if task != None:
+                task.stop(STOP_TIMEOUT)
+        self.observations = self.rain = None
+        logger.flush()
 
 _plugin = BasePlugin()
 
+# The locations served by the plugin, the one in the Settings first
+locations = []
+
 def onStart():
-    while CheckInternet() == False:
-        print("You do not have a working internet connection.")
-        time.sleep(100)
     _plugin.onStart()
 
 def onHeartbeat():
     _plugin.onHeartbeat()
 
+def onStop():
+    _plugin.onStop()
+
 #############################################################################
 #                         Domoticz helper functions                         #
 #############################################################################
 
-def CheckInternet():
-    try:
-        requests.get(url='http://www.google.com/', timeout=5)
-        return True
-    except requests.ConnectionError:
-        return False
-
+# With Mode6 "File" the message is also written to plugin.log
 def LogMessage(Message):
-    if Parameters["Mode6"] == "File":
-        f = open(Parameters["HomeFolder"] + "plugin.log", "a")
-        f.write(Message + "\r\n")
-        f.close()
-    Domoticz.Debug(Message)
+    logger.debug(Message)
 
 def DumpConfigToLog():
     for x in Parameters:
@@ -200,20 +388,65 @@ def DumpConfigToLog():
         LogMessage("Device LastLevel: " + str(Devices[x].LastLevel))
     return
 
+# Parse the comma separated timeframes for the rain forecast
+def parseTimeframes(value):
+    timeframes = []
+    for part in value.split(","):
+        try:
+            timeframe = int(part)
+        except ValueError:
+            logger.log("Unable to parse timeframe '{}', it is ignored", part.strip())
+            continue
+        if timeframe < 5 or timeframe > 120:
+            logger.log("Timeframe must be >=5 and <=120, {} is ignored", timeframe)
+            continue
+        if timeframe not in timeframes:
+            timeframes.append(timeframe)
+
+    if len(timeframes) == 0:
+        logger.log("No valid timeframe, set to 30 minutes")
+        timeframes.append(30)
+
+    if len(timeframes) > 1 + MAX_HORIZONS:
+        logger.log("Only {} extra timeframes are supported", MAX_HORIZONS)
+        del timeframes[1 + MAX_HORIZONS:]
+
+    return timeframes
+
+# Parse the comma separated extra locations, each is latitude;longitude
+def parseLocations(value):
+    coordinates = []
+    for part in value.split(","):
+        if part.strip() == "":
+            continue
+        try:
+            lat, lon = [ float(x) for x in part.split(";") ]
+        except ValueError:
+            logger.log("Unable to parse location '{}', it is ignored", part.strip())
+            continue
+        if (lat, lon) not in coordinates:
+            coordinates.append((lat, lon))
+
+    if len(coordinates) > MAX_LOCATIONS - 1:
+        logger.log("Only {} extra locations are supported", MAX_LOCATIONS - 1)
+        del coordinates[MAX_LOCATIONS - 1:]
+
+    return coordinates
+
 # Update Device into database
 def UpdateDevice(Unit, nValue, sValue, AlwaysUpdate=False):
     # Make sure that the Domoticz device still exists (they can be deleted) before updating it
     if Unit in Devices:
         if Devices[Unit].nValue != nValue or Devices[Unit].sValue != sValue or AlwaysUpdate == True:
             Devices[Unit].Update(nValue, str(sValue))
-            Domoticz.Log("Update " + Devices[Unit].Name + ": " + str(nValue) + " - '" + str(sValue) + "'")
+            logger.log("Update {}: {} - '{}'", Devices[Unit].Name, nValue, sValue)
     return
 
 #############################################################################
 #                       Device specific functions                           #
 #############################################################################
 
-def createDevices():
+def createDevices(location):
 
     # Are there any devices?
     ###if len(Devices) != 0:
@@ -222,100 +455,190 @@ def createDevices():
 
     # Give the devices a unique unit number. This makes updating them more easy.
     # UpdateDevice() checks if the device exists before trying to update it.
+    # The units and names of an extra location are set by the location.
+    unit = location.unit
+    name = location.name
 
     # Add the temperature and humidity device(s)
     if Parameters["Mode4"] == "True":
-        if 3 not in Devices:
-            Domoticz.Device(Name="Temperature", Unit=3, TypeName="Temp+Hum", Used=1).Create()
+        if unit(3) not in Devices:
+            Domoticz.Device(Name=name("Temperature"), Unit=unit(3), TypeName="Temp+Hum", Used=1).Create()
     else:
-        if 1 and 2 not in Devices:
-            Domoticz.Device(Name="Temperature", Unit=1, TypeName="Temperature", Used=1).Create()
-            Domoticz.Device(Name="Humidity", Unit=2, TypeName="Humidity", Used=1).Create()
+        if unit(1) and unit(2) not in Devices:
+            Domoticz.Device(Name=name("Temperature"), Unit=unit(1), TypeName="Temperature", Used=1).Create()
+            Domoticz.Device(Name=name("Humidity"), Unit=unit(2), TypeName="Humidity", Used=1).Create()
 
     # Add the barometer device
-    if 4 not in Devices:
-        Domoticz.Device(Name="Barometer", Unit=4, TypeName="Barometer", Used=1).Create()
+    if unit(4) not in Devices:
+        Domoticz.Device(Name=name("Barometer"), Unit=unit(4), TypeName="Barometer", Used=1).Create()
 
     # Add the wind (and wind chill?) device
     if Parameters["Mode5"] == "True":
-        if 6 not in Devices:
-            Domoticz.Device(Name="Wind", Unit=6, TypeName="Wind+Temp+Chill", Used=1).Create()
+        if unit(6) not in Devices:
+            Domoticz.Device(Name=name("Wind"), Unit=unit(6), TypeName="Wind+Temp+Chill", Used=1).Create()
     else:
-        if 5 not in Devices:
-            Domoticz.Device(Name="Wind", Unit=5, TypeName="Wind", Used=1).Create()
-
-    if 7 not in Devices:
-        Domoticz.Device(Name="Visibility", Unit=7, TypeName="Visibility", Used=1).Create()
-    if 8 not in Devices:
-        Domoticz.Device(Name="Solar Radiation", Unit=8, TypeName="Solar Radiation", Used=1).Create()
-    if 9 not in Devices:
-        Domoticz.Device(Name="Current Rain rate", Unit=9, TypeName="Rain", Used=1).Create()
-    if 10 not in Devices:
-        Domoticz.Device(Name="Rain forecast", Unit=10, TypeName="Rain", Used=1).Create()
-    if 11 not in Devices:
-        Domoticz.Device(Name="Weather forecast", Unit=11, TypeName="Text", Used=1).Create()
-
-    Domoticz.Log("Devices checked and created/updated if necessary")
-
-def fillDevices():
-
-    # Did we get new weather info? Update all the possible devices
-    if br.getWeather():
-
-        # Temperature
-        if br.temperature != None:
-            UpdateDevice(1, 0, str(round(br.temperature, 1)))
-
-        # Humidity
-        if br.humidity != None:
-            UpdateDevice(2, br.humidity, str(br.getHumidityStatus()))
-
-        # Temperature and Humidity
-        if br.temperature != None and br.humidity != None:
-            UpdateDevice(3, 0,
-                    str(round(br.temperature, 1))
-                    + ";" + str(br.humidity)
-                    + ";" + str(br.getHumidityStatus()))
-
-        # Barometer
-        if br.pressure != None:
-            UpdateDevice(4, 0,
-                    str(round(br.pressure, 1))
-                    + ";" + str(br.getBarometerForecast()))
-
-        # Wind
-        if br.windBearing != None and br.windSpeed != None and br.windSpeedGusts != None:
-            UpdateDevice(5, 0, str(br.windBearing)
-                    + ";" + br.getWindDirection()
-                    + ";" + str(round(br.windSpeed * 10))
-                    + ";" + str(round(br.windSpeedGusts * 10))
-                    + ";0;0")
-            # Wind and Wind Chill
-            UpdateDevice(6, 0, str(br.windBearing)
-                    + ";" + br.getWindDirection()
-                    + ";" + str(round(br.windSpeed * 10))
-                    + ";" + str(round(br.windSpeedGusts * 10))
-                    + ";" + str(round(br.temperature, 1))
-                    + ";" + str(br.getWindChill()))
-
-        # Visibility
-        if br.visibility != None:
-            UpdateDevice(7, 0, str(round((br.visibility/1000), 1))) # Visibility is m in Buienradar and km in Domoticz
-
-        # Solar Radiation
-        if br.solarIrradiance != None:
-            UpdateDevice(8, 0, str(br.solarIrradiance))
-
-        # Rain rate
-        if br.rainRate == None: br.rainRate = 0
-        UpdateDevice(9, 0, str(br.rainRate*100)+";"+str(br.rainToday))
-
-        # Rain forecast
-        result = rf.get_precipfc_data() ###30 nog nakijken
-        UpdateDevice(10, 0, str(result['averagemm']*100)+";"+str(result['average']))
-
-        if br.weatherForecast != None:
-            UpdateDevice(11, 0, str(br.weatherForecast))
+        if unit(5) not in Devices:
+            Domoticz.Device(Name=name("Wind"), Unit=unit(5), TypeName="Wind", Used=1).Create()
+
+    if unit(7) not in Devices:
+        Domoticz.Device(Name=name("Visibility"), Unit=unit(7), TypeName="Visibility", Used=1).Create()
+    if unit(8) not in Devices:
+        Domoticz.Device(Name=name("Solar Radiation"), Unit=unit(8), TypeName="Solar Radiation", Used=1).Create()
+    if unit(9) not in Devices:
+        Domoticz.Device(Name=name("Current Rain rate"), Unit=unit(9), TypeName="Rain", Used=1).Create()
+    if unit(10) not in Devices:
+        Domoticz.Device(Name=name("Rain forecast"), Unit=unit(10), TypeName="Rain", Used=1).Create()
+    if unit(11) not in Devices:
+        Domoticz.Device(Name=name("Weather forecast"), Unit=unit(11), TypeName="Text", Used=1).Create()
+
+    # The rain forecast devices for the extra timeframes
+    for index, timeframe in enumerate(location.horizons):
+        if unit(HORIZON_UNIT + index) not in Devices:
+            Domoticz.Device(Name=name("Rain forecast " + str(timeframe) + " min"), Unit=unit(HORIZON_UNIT + index), TypeName="Rain", Used=1).Create()
+
+    # The statistics of the plugin, only when it is added to the used devices
+    if location.index == 0 and STATS_UNIT not in Devices:
+        Domoticz.Device(Name="Plugin statistics", Unit=STATS_UNIT, TypeName="Text", Used=0).Create()
+
+    logger.log("Devices checked and created/updated if necessary")
+
+# Download and parse the data, these run in the background threads
+# so they must not change anything the heartbeat uses. The feed is the
+# same for all the locations, the rain forecast is downloaded once for
+# the locations that are close together.
+def fetchObservations():
+    return Snapshot(locations[0].br.fetchFeed(SHARED_FEED_AGE), None, time.monotonic())
+
+def fetchRain():
+    rain = get_precipfc_batch([ location.rf for location in locations ])
+    if all(forecast == None for forecast in rain):
+        rain = None
+    return Snapshot(None, rain, time.monotonic())
+
+# The time of the observation of the first location with a weather station,
+# the feed is published for all the stations at the same time
+def firstObservationDate():
+    for location in locations:
+        if location.br.stationID != "":
+            return location.br.observation.observationDate
+    return None
+
+def fillDevices(location, rain=None):
+
+    with stats.timed('devices'):
+        # Did we get new weather info? Update all the possible devices
+        payloads = {}
+        if location.br.getWeather():
+            payloads = buildPayloads(location.br.observation)
+
+        # The rain forecast does not depend on the weather station
+        if rain != None:
+            payloads.update(rainPayloads(rain, location.horizons))
+
+        return pushPayloads({ location.unit(unit): payload for unit, payload in payloads.items() })
+
+# Update the rain forecast devices of a location only
+def fillRainDevices(location, rain):
+
+    with stats.timed('devices'):
+        return pushPayloads({ location.unit(unit): payload for unit, payload in rainPayloads(rain, location.horizons).items() })
+
+# The nValue and sValue of every device, by unit, calculated once from the observation
+def buildPayloads(obs):
+    payloads = {}
+
+    # Temperature
+    if obs.temperature != None:
+        temperature = str(round(obs.temperature, 1))
+        payloads[1] = (0, temperature)
+
+    # Humidity
+    if obs.humidity != None:
+        humidityStatus = str(obs.getHumidityStatus())
+        payloads[2] = (obs.humidity, humidityStatus)
+
+    # Temperature and Humidity
+    if obs.temperature != None and obs.humidity != None:
+        payloads[3] = (0, temperature + ";" + str(obs.humidity) + ";" + humidityStatus)
+
+    # Barometer
+    if obs.pressure != None:
+        payloads[4] = (0, str(round(obs.pressure, 1)) + ";" + str(obs.getBarometerForecast()))
+
+    # Wind
+    if obs.windBearing != None and obs.windSpeed != None and obs.windSpeedGusts != None:
+        wind = (str(obs.windBearing)
+                + ";" + obs.getWindDirection()
+                + ";" + str(round(obs.windSpeed * 10))
+                + ";" + str(round(obs.windSpeedGusts * 10)))
+        payloads[5] = (0, wind + ";0;0")
+        # Wind and Wind Chill
+        payloads[6] = (0, wind
+                + ";" + str(round(obs.temperature, 1))
+                + ";" + str(obs.getWindChill()))
+
+    # Visibility
+    if obs.visibility != None:
+        payloads[7] = (0, str(round((obs.visibility/1000), 1))) # Visibility is m in Buienradar and km in Domoticz
+
+    # Solar Radiation
+    if obs.solarIrradiance != None:
+        payloads[8] = (0, str(obs.solarIrradiance))
+
+    # Rain rate
+    rainRate = obs.rainRate if obs.rainRate != None else 0
+    payloads[9] = (0, str(rainRate*100)+";"+str(obs.rainToday))
+
+    if obs.weatherForecast != None:
+        payloads[11] = (0, str(obs.weatherForecast))
+
+    return payloads
+
+# The nValue and sValue of the rain forecast devices, by unit
+def rainPayloads(rain, horizons=()):
+    payloads = {}
+
+    # Rain forecast
+    payloads[10] = (0, str(rain['averagemm']*100)+";"+str(rain['average']))
+
+    # Rain forecast for the extra timeframes
+    for index, timeframe in enumerate(horizons):
+        horizon = rain['horizons'].get(timeframe)
+        if horizon != None:
+            payloads[HORIZON_UNIT + index] = (0, str(horizon['averagemm']*100)+";"+str(horizon['average']))
+
+    return payloads
+
+# The payloads last sent to Domoticz, by unit
+_sentPayloads = {}
+
+# Send the payloads that changed since the last time to Domoticz.
+# Returns the number of devices that were updated
+def pushPayloads(payloads):
+
+    # Make sure that the Domoticz device still exists (they can be deleted) before updating it
+    changed = [ (unit, payload) for unit, payload in payloads.items()
+                if _sentPayloads.get(unit) != payload and unit in Devices ]
+
+    updates = 0
+    for unit, (nValue, sValue) in changed:
+        _sentPayloads[unit] = (nValue, sValue)
+        device = Devices[unit]
+        if device.nValue != nValue or device.sValue != sValue:
+            device.Update(nValue, sValue)
+            logger.log("Update {}: {} - '{}'", device.Name, nValue, sValue)
+            updates += 1
+
+    stats.count('deviceWrites', updates)
+
+    logger.debug("Devices updated: {} of {}", updates, len(payloads))
+    return updates
+
+# Write the statistics to the stats device and stats.json in the plugin folder
+def updateStats():
+    stats.writeFile(Parameters["HomeFolder"] + "stats.json")
+    if STATS_UNIT in Devices and Devices[STATS_UNIT].Used == 1:
+        UpdateDevice(STATS_UNIT, 0, stats.summary())
 
 # Synchronise images to match parameter in hardware page
 def UpdateImage(Unit, Logo):
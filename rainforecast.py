@@ -5,97 +5,293 @@
 # Author: Gerard - https://github.com/seventer/raintocome
 # Updates: G3rard, August 2017, with input from https://github.com/mjj4791/python-buienradar/blob/master/buienradar/buienradar.py
 
-try:
-    import Domoticz
-except ImportError:
-    import fakeDomoticz as Domoticz
-
 import math
-import urllib.request
+import re
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from diskcache import DiskCache
+from httpclient import client, HttpError
+import logger
+import stats
+
+# Where to get the forecast
+# https://br-gpsgadget-new.azurewebsites.net/data/raintext?lat=51&lon=3
+RAIN_URL        = "https://gps.buienradar.nl/getrr.php?lat={}&lon={}"
+RAIN_URL_BACKUP = "http://gadgets.buienradar.nl/data/raintext?lat={}&lon={}"
+
+# Minutes a downloaded forecast is used before it is downloaded again
+RAIN_REFRESH    = 15
+
+# Minutes the copy of the forecast on disk can be used after a restart,
+# Buienradar forecasts two hours
+RAIN_CACHE_AGE  = 120
+
+# Number of rain forecasts that are downloaded at the same time
+MAX_DOWNLOADS   = 4
+
+# A line of the forecast, like 057|18:30
+RAIN_LINE       = re.compile(r'^\s*(\d+)\|(\d{1,2}):(\d{2})', re.MULTILINE)
+
+# Intensity to mm/hour, see https://www.buienradar.nl/overbuienradar/gratis-weerdata
+MM_PER_HOUR     = tuple(0.0 if val == 0 else 10**(float(val - 109)/32) for val in range(256))
+
+class RainSeries:
+    """The forecasted intensities, with the minutes since the first slot."""
+
+    __slots__ = ('start', 'offsets', 'intensities', 'sums')
+
+    def __init__(self, start, offsets, intensities):
+        self.start          = start         # Time of the first slot
+        self.offsets        = offsets       # array('H') of minutes since the first slot
+        self.intensities    = intensities   # array('B') of intensities, 0 - 255
+
+        # sums[i] is the total rain rate of the slots before slot i,
+        # so the total of any range of slots is one subtraction
+        self.sums           = array('d', [0.0])
+        total = 0.0
+        for val in intensities:
+            total += MM_PER_HOUR[val]
+            self.sums.append(total)
+
+    def __len__(self):
+        return len(self.intensities)
+
+    @classmethod
+    def parse(cls, text, now):
+        """Parse the lines like '057|18:30', with the times resolved around now."""
+
+        lines = RAIN_LINE.findall(text)
+        if len(lines) == 0:
+            return cls(now, array('H'), array('B'))
+
+        intensities = array('B', [min(255, int(val)) for val, _, _ in lines])
+        minutes = [int(hours) * 60 + int(mins) for _, hours, mins in lines]
+
+        # Past midnight the minutes start at 0 again
+        first = minutes[0]
+        offsets = array('H', [(minute - first) % 1440 for minute in minutes])
+
+        # The first slot is close to now, but can be on the other side of midnight
+        start = now.replace(hour=first // 60, minute=first % 60, second=0, microsecond=0)
+        if start - now > timedelta(hours=12):
+            start -= timedelta(days=1)
+        elif now - start > timedelta(hours=12):
+            start += timedelta(days=1)
+
+        return cls(start, offsets, intensities)
+
+    def slot(self, index):
+        """Time of a slot."""
+        return self.start + timedelta(minutes=self.offsets[index])
+
+    def index_at(self, now):
+        """Index of the slot we are in now, the slots before it are in the past."""
+        minutes = (now - self.start).total_seconds() / 60
+        return max(0, bisect_right(self.offsets, minutes) - 1)
+
+    def rates(self, first, last):
+        """The rain rates in mm/hour of the slots first up to last."""
+        return [MM_PER_HOUR[val] for val in self.intensities[first:last]]
+
+    def total(self, first, last):
+        """The total rain rate of the slots first up to last."""
+        return self.sums[last] - self.sums[first]
+
+    def running_max(self, first, last):
+        """The maximum rain rate of the slots first up to first, first + 1, ..., last."""
+        result = array('d')
+        highest = 0.0
+        for val in self.intensities[first:last]:
+            highest = max(highest, MM_PER_HOUR[val])
+            result.append(highest)
+        return result
 
 class RainForecast:
 
-    def __init__(self, latitude=52.101547, longitude=5.177919, timeframe=30, showmax = True):
+    def __init__(self, latitude=52.101547, longitude=5.177919, timeframe=30, showmax = True, cacheFolder=None, refresh=RAIN_REFRESH, horizons=()):
         self.rainFile       = None
+        self.series         = None      # The parsed forecast, a RainSeries
+        self.fetched        = None      # When the forecast was downloaded
+        self._refresh       = refresh   # Minutes before the forecast is downloaded again
         self.url            = None
         self.urlbackup      = None
         self._lat           = latitude
         self._lon           = longitude
         self._timeframe     = timeframe
+        self._horizons      = tuple(horizons)   # Extra timeframes calculated from the same forecast
         # keys in forcasted precipitation data
         self.AVERAGE        = 'average'
         self.AVERAGEMM      = 'averagemm'
         self.TIMEFRAME      = 'timeframe'
         self.TOTAL          = 'total'
+        self.HORIZONS       = 'horizons'
         self.ShowMax        = showmax
+        self._cache         = None      # Copy of the forecast on disk
+        if cacheFolder != None:
+            self._cache     = DiskCache(cacheFolder, "raintext_{}_{}".format(*self.cell()))
+
+    def cell(self):
+        """The coordinates rounded like in the URL, locations in the same cell get the same forecast."""
+
+        return (round(float(self._lat),2), round(float(self._lon),2))
 
     def get_rain(self, file=''):
         """Get the forecasted precipitation data."""
 
-        Domoticz.Debug("Rain forecast started with following coordinates from Domoticz: " + str(self._lat) + ";" + str(self._lon))
+        logger.debug("Rain forecast started with following coordinates from Domoticz: {};{}", self._lat, self._lon)
 
         if file != '':
             with open(file, 'r') as myfile:
                 self.rainFile = myfile.read()
+            self.series = None
+            self.fetched = datetime.now()
             return self.rainFile
 
-        # https://br-gpsgadget-new.azurewebsites.net/data/raintext?lat=51&lon=3
-        self.url = "https://gps.buienradar.nl/getrr.php?lat={}&lon={}".format(round(float(self._lat),2), round(float(self._lon),2))
-        Domoticz.Debug("Rain forecast url: " + self.url)
-        self.urlbackup = "http://gadgets.buienradar.nl/data/raintext?lat={}&lon={}".format(round(float(self._lat),2), round(float(self._lon),2))
+        self.url = RAIN_URL.format(*self.cell())
+        logger.debug("Rain forecast url: {}", self.url)
+        self.urlbackup = RAIN_URL_BACKUP.format(*self.cell())
+        with stats.timed('rain'):
+            return self.open_rain()
+
+    def open_rain(self):
+        """Download the forecast from the main or backup URL, whichever answers first.
+        Uses a conditional request when there is a cached copy."""
+
         try:
-            request = urllib.request.Request(self.url)
-            with urllib.request.urlopen(request) as response:
-                self.rainFile = response.read().decode('utf-8')
+            url, response = client.getHedged([self.url, self.urlbackup], self.conditional_headers)
+        except HttpError as e:
+            logger.error("HTTP error in rain predictor: {}", e)
+            return
+
+        if response.status == 304:
+            # Not modified, keep the forecast we already have
+            logger.debug("Rain forecast has not changed since the last download")
+            if self.rainFile == None and not self.load_cache(max_age=None) and self._cache != None:
+                # The copy on disk is broken, download all of it next time
+                self._cache.forget()
+            self.fetched = datetime.now()
             return self.rainFile
-        except (urllib.error.HTTPError, urllib.error.URLError) as e:
-            Domoticz.Error("HTTP error in rain predictor: " + str(e) + " URL: " + self.url)
-            Domoticz.Log("Going to try another Buienradar URL")
-            try:
-                request = urllib.request.Request(self.urlbackup)
-                with urllib.request.urlopen(request) as response:
-                    self.rainFile = response.read().decode('utf-8')
-                return self.rainFile
-            except (urllib.error.HTTPError, urllib.error.URLError) as e:
-                Domoticz.Error("HTTP error in rain predictor: " + str(e) + " URL: " + self.urlbackup)
-                return
-
-    def parse_precipfc_data(self):
-        """Parse the forecasted precipitation data."""
+
+        # Only keep a copy on disk that could be parsed, otherwise the
+        # conditional requests would keep using a broken copy
+        rainFile, series = self.parse_body(response.body)
+        if series == None:
+            logger.error("No rain forecast found in the answer of {}", url)
+            return None
+
+        if self._cache != None:
+            self._cache.save(url, response.body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        self.rainFile = rainFile
+        self.series = series
+        self.fetched = datetime.now()
+        return self.rainFile
+
+    def parse_body(self, body, now=None):
+        """Decode and parse a downloaded forecast, the series is None when it contains no forecast."""
+
+        if now == None:
+            now = datetime.now()
+        try:
+            text = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return None, None
+
+        series = RainSeries.parse(text, now)
+        if len(series) == 0:
+            return text, None
+        return text, series
+
+    def conditional_headers(self, url):
+        """The headers for a conditional request of the url."""
+
+        if self._cache == None:
+            return {}
+        return self._cache.conditionalHeaders(url)
+
+    def load_cache(self, max_age=RAIN_CACHE_AGE):
+        """Use the copy of the forecast on disk, to fill the devices right after a restart.
+        A copy older than max_age minutes is not used, its times would be placed in the future."""
+
+        if self._cache == None:
+            return False
+
+        body = self._cache.load(max_age * 60 if max_age != None else None)
+        if body == None:
+            return False
+
+        rainFile, series = self.parse_body(body)
+        if series == None:
+            return False
+
+        self.rainFile = rainFile
+        self.series = series
+        self.fetched = self._cache.saved()
+        return True
+
+    def is_current(self, now=None):
+        """Can the cached forecast still be used for the whole timeframe?"""
+
+        if self.fetched == None or self.rainFile == None:
+            return False
+
+        if now == None:
+            now = datetime.now()
+        if now - self.fetched >= timedelta(minutes=self._refresh):
+            return False
+
+        if self.series == None:
+            self.series = RainSeries.parse(self.rainFile, now)
+
+        # Buienradar sends two hours, a longer timeframe is never fully covered
+        nrlines = min(len(self.series), round(float(max((self._timeframe,) + self._horizons))/5) + 1)
+        return self.series.index_at(now) + nrlines <= len(self.series)
+
+    def parse_precipfc_data(self, now=None):
+        """Parse the forecasted precipitation data, starting at the slot we are in now.
+        The results of the extra horizons are in result[HORIZONS], by timeframe."""
         # Is the data available?
         if self.rainFile == None:
-            Domoticz.Error("No correct data found from Buienradar site")
-            return 0, 0.0
+            logger.error("No correct data found from Buienradar site")
+            return None
 
-        result = {self.AVERAGE: None, self.AVERAGEMM: None, self.TOTAL: None, self.TIMEFRAME: None}
+        if now == None:
+            now = datetime.now()
+        if self.series == None:
+            self.series = RainSeries.parse(self.rainFile, now)
 
-        maxrain = totalrainmm = numberoflines = 0
-        lines = self.rainFile.splitlines()
-        index = 0
-        nrlines = min(len(lines), round(float(self._timeframe)/5) + 1)
-        Domoticz.Debug("Timeframe: " + str(self._timeframe) + ", rows: " + str(nrlines))
-        while index < nrlines:
-            line = lines[index]
-            (val, key) = line.split("|")
-            #calculate intensity to mm, see https://www.buienradar.nl/overbuienradar/gratis-weerdata
-            if int(val) == 0:
-                mmu = 0
-            else:
-                mmu = 10**(float((int(val) - 109))/32)
+        # All timeframes start at the same slot, so one running maximum serves them all
+        timeframes = (self._timeframe,) + self._horizons
+        first = self.series.index_at(now)
+        last = min(len(self.series), first + round(float(max(timeframes))/5) + 1)
+        maxima = self.series.running_max(first, last)
+
+        logger.debug("Timeframe: {}, rows: {}", self._timeframe, min(last - first, round(float(self._timeframe)/5) + 1))
+        if last > first and logger.isEnabled(logger.DEBUG):
+            logger.debug("Intensities from {}: {}", self.series.slot(first).strftime('%H:%M'),
+                         " ".join(str(val) for val in self.series.intensities[first:last]))
 
-            if maxrain < mmu:
-                maxrain = mmu
+        result = self.window(self._timeframe, first, maxima)
+        result[self.HORIZONS] = {timeframe: self.window(timeframe, first, maxima) for timeframe in self._horizons}
 
-            totalrainmm += float(mmu)
-            numberoflines += 1
-            index += 1
-            Domoticz.Debug(str(val) + '|' + str(key))
+        #return result
+        logger.log("Rain forecast: {} mm | {} mm/hour", result[self.AVERAGE], result[self.AVERAGEMM])
+        return result
+
+    def window(self, timeframe, first, maxima):
+        """Calculate the forecast for the timeframe, starting at slot first."""
+
+        result = {self.AVERAGE: None, self.AVERAGEMM: None, self.TOTAL: None, self.TIMEFRAME: None}
+
+        numberoflines = min(len(maxima), round(float(timeframe)/5) + 1)
+        totalrainmm = self.series.total(first, first + numberoflines)
 
         if numberoflines > 0:
             averagerainrate = totalrainmm / numberoflines
             if self.ShowMax == True:
                 #Return the max rainrate
-                result[self.AVERAGEMM] = round(maxrain,2) #mm/h
+                result[self.AVERAGEMM] = round(maxima[numberoflines - 1],2) #mm/h
             else:
                 #Return the average rainrate
                 result[self.AVERAGEMM] = round(averagerainrate, 2)#mm/h
@@ -104,16 +300,58 @@ class RainForecast:
             #mm/u * u = mm
             result[self.AVERAGE] = round(averagerainrate * (numberoflines / 12), 1)#mm
         else:
-            Domoticz.Log("No data found from Buienradar containing rain forecast, assuming rain forecast is 0")
+            logger.log("No data found from Buienradar containing rain forecast, assuming rain forecast is 0")
             result[self.AVERAGE] = 0
             result[self.AVERAGEMM] = 0.0
         result[self.TOTAL] = round(totalrainmm/12, 2)
-        result[self.TIMEFRAME] = self._timeframe
-
-        #return result
-        Domoticz.Log("Rain forecast: " + str(result[self.AVERAGE]) + " mm | " + str(result[self.AVERAGEMM]) + " mm/hour")
+        result[self.TIMEFRAME] = timeframe
         return result
 
     def get_precipfc_data(self, file=''):
-        self.get_rain(file)
+        # The forecast we have still covers the timeframe, slide over it
+        if file == '' and self.is_current():
+            logger.debug("Rain forecast still current, not downloaded again")
+            return self.parse_precipfc_data()
+
+        # Do not show an old forecast when the download failed
+        if self.get_rain(file) == None:
+            return None
+
+        # When nothing changed the parsed series is used again
         return self.parse_precipfc_data()
+
+    def share(self, other):
+        """Use the forecast downloaded by another instance in the same cell."""
+
+        self.rainFile       = other.rainFile
+        self.series         = other.series
+        self.fetched        = other.fetched
+        self.url            = other.url
+        self.urlbackup      = other.urlbackup
+
+def get_precipfc_batch(forecasts, maxDownloads=MAX_DOWNLOADS):
+    """Get the forecasted precipitation data of many RainForecast instances, in the same order.
+    The instances in the same cell share one download, and the cells are downloaded
+    at the same time, at most maxDownloads at once."""
+
+    cells = {}
+    for forecast in forecasts:
+        cells.setdefault(forecast.cell(), []).append(forecast)
+
+    # Only download the cells of which a forecast does not cover its timeframe anymore
+    stale = [ members for members in cells.values() if not all(forecast.is_current() for forecast in members) ]
+    failed = set()
+    if len(stale) > 0:
+        logger.debug("Rain forecast of {} locations, downloading {} of {} cells", len(forecasts), len(stale), len(cells))
+        with ThreadPoolExecutor(max_workers=min(maxDownloads, len(stale)), thread_name_prefix='Rain forecast') as pool:
+            downloaded = list(pool.map(lambda members: members[0].get_rain(), stale))
+
+        for members, rainFile in zip(stale, downloaded):
+            # Do not show an old forecast when the download failed
+            if rainFile == None:
+                failed.update(id(forecast) for forecast in members)
+                continue
+            for forecast in members[1:]:
+                forecast.share(members[0])
+
+    return [ None if id(forecast) in failed else forecast.parse_precipfc_data() for forecast in forecasts ]
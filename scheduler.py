@@ -0,0 +1,130 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Decide when to download the feed again. Buienradar publishes new
+#   observations at a fixed cadence, some time after the time of the
+#   observation itself. Both are learned from the time of the observations
+#   in the feed, so the next download is planned just after the next
+#   publication that is at least the interval after the last one. When
+#   the feed did not change yet, it is tried once more soon, after that it
+#   waits for the next publication.
+#
+
+from collections import deque
+from math import ceil
+from datetime import datetime, timedelta
+
+# Minutes between the observations until the cadence has been learned
+DEFAULT_CADENCE = 10
+
+# Download this long after the expected publication
+PUBLISH_MARGIN  = timedelta(seconds=30)
+
+# Wait before trying once more when the feed has not changed yet
+RETRY           = timedelta(seconds=60)
+
+# The publication delay that is learned is made this part of the cadence
+# shorter with every publication, so a site that publishes faster is noticed
+# as well. Until it is known between which downloads an observation was
+# published, the first guess can be a whole cadence too long, so it is
+# made shorter faster. The delay also contains the difference between the
+# time zones of Buienradar and Domoticz, so it can be negative.
+LAG_STEP        = 0.001
+LAG_STEP_FIRST  = 0.1
+
+# Number of cadences that are remembered
+HISTORY         = 6
+
+class PublishScheduler:
+
+    def __init__(self, interval, cadence=DEFAULT_CADENCE):
+        self._interval      = timedelta(minutes=interval)   # Minimum time between the downloads
+        self._default       = timedelta(minutes=cadence)
+        self._cadences      = deque(maxlen=HISTORY)         # Time between the observations
+        self.lag            = None          # Time between an observation and its publication
+        self.lagMeasured    = False         # Was the lag measured between two downloads?
+        self.lastPublished  = None          # Time of the newest observation
+        self.target         = None          # Time of the observation the next download is for
+        self.lastFetch      = None          # When the feed was downloaded
+        self.unchanged      = 0             # Downloads in a row without the observation they were for
+        self.nextFetch      = None          # When to download again, None for now
+
+    #
+    # The time between two observations, the shortest one seen lately
+    # so an observation that was skipped does not count
+    #
+
+    def cadence(self):
+
+        if len(self._cadences) == 0:
+            return self._default
+        return min(self._cadences)
+
+    #
+    # Record a download with the time of the newest observation in it, None
+    # when that is not known. Returns when to download again.
+    #
+
+    def fetched(self, published, now=None):
+
+        if now == None:
+            now = datetime.now()
+
+        previous = self.lastFetch
+        self.lastFetch = now
+
+        if published == None:
+            self.nextFetch = now + self._interval
+            return self.nextFetch
+
+        if self.lastPublished != None and published > self.lastPublished:
+            self._cadences.append(published - self.lastPublished)
+        if self.lastPublished == None or published > self.lastPublished:
+            self.lastPublished = published
+
+        # The observation the download was for is not there yet, so it takes
+        # longer to publish. Try once more soon, when it is still not there
+        # wait for the next publication.
+        if self.target != None and published < self.target:
+            self.lag = max(self.lag, now - self.target)
+            self.unchanged += 1
+            if self.unchanged == 1:
+                self.nextFetch = now + min(RETRY, self._interval)
+            else:
+                self.nextFetch = self.expected(now)
+            return self.nextFetch
+
+        # After a download without the observation, it is known to be
+        # published between that download and this one. Otherwise it could
+        # have been published long before, so slowly try earlier.
+        if self.unchanged > 0 and previous != None:
+            self.lag = now - published
+            self.lagMeasured = True
+        elif self.lag == None:
+            self.lag = now - published
+        else:
+            step = self.cadence() * (LAG_STEP if self.lagMeasured else LAG_STEP_FIRST)
+            self.lag = min(now - published, self.lag - step)
+
+        self.unchanged = 0
+        self.nextFetch = self.expected(now)
+        return self.nextFetch
+
+    #
+    # When the first observation that is at least the interval after the
+    # last one and still to come is published, plus the margin
+    #
+
+    def expected(self, now):
+
+        cadence = self.cadence()
+        self.target = self.lastPublished + max(1, ceil(self._interval / cadence)) * cadence
+        while self.target + self.lag + PUBLISH_MARGIN < now:
+            self.target += cadence
+        return self.target + self.lag + PUBLISH_MARGIN
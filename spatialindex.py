@@ -0,0 +1,126 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   KD-tree of the weather stations on the unit sphere.
+#   The stations are stored as 3D points, so the straight line (chord)
+#   distance between two points only grows with the great circle distance.
+#
+
+import heapq
+from math import radians, cos, sin, asin
+
+# Same earth radius as Buienradar.haversine()
+EARTH_RADIUS = 6367
+
+#
+# Convert a location in decimal degrees to a point on the unit sphere
+#
+
+def toUnitVector(lat, lon):
+
+    lat, lon = radians(lat), radians(lon)
+    return (cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat))
+
+#
+# Convert a chord length on the unit sphere to a great circle distance in km
+#
+
+def chordToKm(chord):
+
+    return 2 * asin(min(1.0, chord / 2)) * EARTH_RADIUS
+
+class SpatialIndex:
+
+    def __init__(self, stations):
+
+        # Stations without a location can not be found
+        items = [ (toUnitVector(station.lat, station.lon), station) for station in stations
+                  if station.lat != None and station.lon != None ]
+
+        self._points    = [ point for point, _ in items ]
+        self._stations  = [ station for _, station in items ]
+
+        # The tree is stored in arrays, node n has its children in left[n] and right[n]
+        self._axis      = [ 0 ] * len(items)
+        self._left      = [ -1 ] * len(items)
+        self._right     = [ -1 ] * len(items)
+        self._root      = self._build(list(range(len(items))), 0)
+
+    def __len__(self):
+        return len(self._stations)
+
+    #
+    # Build the (sub)tree for the given points, return the index of its root
+    #
+
+    def _build(self, indices, depth):
+
+        if len(indices) == 0:
+            return -1
+
+        axis = depth % 3
+        indices.sort(key=lambda i: self._points[i][axis])
+        median = len(indices) // 2
+        node = indices[median]
+
+        self._axis[node]    = axis
+        self._left[node]    = self._build(indices[:median], depth + 1)
+        self._right[node]   = self._build(indices[median + 1:], depth + 1)
+        return node
+
+    #
+    # Find the k nearest stations that report all the given fields.
+    # Returns a list of (distance in km, station), the nearest first.
+    #
+
+    def nearest(self, lat, lon, k=1, fields=()):
+
+        if k < 1 or self._root == -1:
+            return []
+
+        target = toUnitVector(lat, lon)
+        points = self._points
+        stations = self._stations
+
+        # Max-heap of the best k so far, stored as (-squared distance, node)
+        best = []
+
+        # Nodes still to visit, with the minimal squared distance to their side of the split
+        stack = [ (self._root, 0.0) ]
+
+        while stack:
+            node, bound = stack.pop()
+            if node == -1:
+                continue
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+
+            point = points[node]
+            dx = point[0] - target[0]
+            dy = point[1] - target[1]
+            dz = point[2] - target[2]
+            dist = dx * dx + dy * dy + dz * dz
+
+            station = stations[node]
+            if all(getattr(station, field) != None for field in fields):
+                if len(best) < k:
+                    heapq.heappush(best, (-dist, node))
+                elif dist < -best[0][0]:
+                    heapq.heapreplace(best, (-dist, node))
+
+            # Visit the near side first, the far side only when it can contain a better point
+            axis = self._axis[node]
+            diff = target[axis] - point[axis]
+            near, far = (self._left[node], self._right[node]) if diff < 0 else (self._right[node], self._left[node])
+
+            stack.append((far, diff * diff))
+            stack.append((near, bound))
+
+        result = sorted((-negdist, node) for negdist, node in best)
+        return [ (chordToKm(dist ** 0.5), stations[node]) for dist, node in result ]
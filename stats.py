@@ -0,0 +1,184 @@
+#
+#   Buienradar.nl Weather Lookup Plugin
+#
+#   Frank Fesevur, 2017
+#   https://github.com/ffes/domoticz-buienradar
+#
+#   About the weather service:
+#   https://www.buienradar.nl/overbuienradar/gratis-weerdata
+#
+#   Timing of the phases of an update and some counters, to find out
+#   where the time of a slow heartbeat went. A phase is timed with:
+#
+#       with stats.timed('parse'):
+#           ...
+#
+#   The numbers are shown in a Text device and written to a JSON file.
+#
+
+import json
+import os
+import threading
+import time
+import logger
+
+# Upper bounds in milliseconds of the buckets of the latency histograms,
+# the last bucket counts everything that took longer
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# The phases in the order they are shown
+PHASES  = ('download', 'parse', 'nearest', 'rain', 'devices')
+
+_lock       = threading.Lock()
+_phases     = {}        # name -> Phase
+_hosts      = {}        # host -> Phase, the latency of the requests
+_counters   = {}        # name -> number
+_started    = time.time()
+
+#
+# The latency histogram of a phase
+#
+
+class Phase:
+
+    def __init__(self):
+        self.count      = 0
+        self.total      = 0.0       # seconds
+        self.maximum    = 0.0       # seconds
+        self.last       = 0.0       # seconds
+        self.buckets    = [ 0 ] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        self.last = seconds
+
+        ms = seconds * 1000
+        for index, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def toDict(self):
+
+        return {
+            'count':    self.count,
+            'averageMs': round(self.total / self.count * 1000, 1) if self.count > 0 else None,
+            'maxMs':    round(self.maximum * 1000, 1),
+            'lastMs':   round(self.last * 1000, 1),
+            'buckets':  dict(zip([ '<=' + str(bound) for bound in BUCKETS ] + [ '>' + str(BUCKETS[-1]) ], self.buckets)),
+        }
+
+#
+# Time the code in a with statement as a phase
+#
+
+class Timer:
+
+    def __init__(self, phase):
+        self._phase     = phase
+        self._started   = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self._phase, time.perf_counter() - self._started)
+        return False
+
+def timed(phase):
+    return Timer(phase)
+
+#
+# Add the seconds a phase took
+#
+
+def record(phase, seconds):
+
+    with _lock:
+        histogram = _phases.get(phase)
+        if histogram == None:
+            histogram = _phases[phase] = Phase()
+        histogram.add(seconds)
+
+#
+# Add the seconds a request to the host took
+#
+
+def recordHost(host, seconds):
+
+    with _lock:
+        histogram = _hosts.get(host)
+        if histogram == None:
+            histogram = _hosts[host] = Phase()
+        histogram.add(seconds)
+
+#
+# Add to a counter
+#
+
+def count(name, amount=1):
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+#
+# All the numbers, as a dictionary that can be written as JSON
+#
+
+def snapshot():
+
+    with _lock:
+        return {
+            'since':    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(_started)),
+            'phases':   { name: phase.toDict() for name, phase in _phases.items() },
+            'hosts':    { host: phase.toDict() for host, phase in _hosts.items() },
+            'counters': dict(_counters),
+        }
+
+#
+# A short text with the average time of the phases and the counters
+#
+
+def summary():
+
+    with _lock:
+        parts = []
+        for name in PHASES + tuple(sorted(set(_phases) - set(PHASES))):
+            phase = _phases.get(name)
+            if phase != None and phase.count > 0:
+                parts.append(name + " " + "{:.0f}".format(phase.total / phase.count * 1000) + " ms")
+        counters = [ name + " " + str(value) for name, value in sorted(_counters.items()) ]
+
+    return ", ".join(parts) + " | " + ", ".join(counters)
+
+#
+# Write the numbers to a JSON file, without leaving a half written file behind
+#
+
+def writeFile(fileName):
+
+    tmpName = fileName + '.tmp'
+    try:
+        with open(tmpName, 'w') as f:
+            json.dump(snapshot(), f, indent=2)
+        os.replace(tmpName, fileName)
+    except OSError as e:
+        logger.error("Unable to write stats file: {}", e)
+
+#
+# Start counting again
+#
+
+def reset():
+
+    global _started
+    with _lock:
+        _phases.clear()
+        _hosts.clear()
+        _counters.clear()
+        _started = time.time()